@@ -2,17 +2,23 @@
 
 from __future__ import annotations
 import os
+import re
 import sys
 import time
 import json
 import math
+import base64
+import hashlib
+import asyncio
+import functools
 import argparse
 import logging
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from typing import List, Dict, Any, Tuple
 
 try:
-    from openai import OpenAI
+    from openai import OpenAI, AsyncOpenAI
 except Exception as e:
     raise SystemExit("openai package with new client required. pip install openai") from e
 
@@ -26,11 +32,20 @@ try:
 except Exception as e:
     raise SystemExit("faiss-cpu required. pip install faiss-cpu") from e
 
+# Use every core for index train/add/search. The stock faiss-cpu wheel picks
+# the best SIMD kernel (AVX2/AVX-512) at runtime when inputs are contiguous.
+faiss.omp_set_num_threads(max(1, os.cpu_count() or 1))
+
 try:
-    from bs4 import BeautifulSoup, Comment
+    from bs4 import BeautifulSoup, Comment, NavigableString
 except Exception as e:
     raise SystemExit("beautifulsoup4 required. pip install beautifulsoup4") from e
 
+try:
+    import orjson
+except Exception as e:
+    raise SystemExit("orjson required. pip install orjson") from e
+
 import numpy as np
 from tqdm import tqdm
 
@@ -40,21 +55,43 @@ try:
 except Exception:
     DOTENV_AVAILABLE = False
 
+try:
+    import numba
+    NUMBA_AVAILABLE = True
+except Exception:
+    NUMBA_AVAILABLE = False
+
 DEFAULT_INPUT_DIR = "blogs_html"
 DEFAULT_INDEX_PATH = "rag_sections.faiss"
 DEFAULT_META_PATH = "rag_sections_meta.jsonl"
 
-EMBEDDING_MODEL = "text-embedding-3-large"  # change to -small to reduce cost
+# Must match generate_blog.py's EMBEDDING_MODEL/EMBEDDING_DIM: queries are
+# embedded there, and mixing models (or dims) between corpus and query makes
+# search results meaningless — or crash outright on the dim mismatch.
+EMBEDDING_MODEL = "text-embedding-3-large"
 _EMBEDDING_DIM_MAP = {"text-embedding-3-large": 3072, "text-embedding-3-small": 1536}
-EMBEDDING_DIM = _EMBEDDING_DIM_MAP.get(EMBEDDING_MODEL)
-if EMBEDDING_DIM is None:
-    raise SystemExit(f"Unknown embedding model: {EMBEDDING_MODEL}")
+# text-embedding-3-* models support server-side truncation via the `dimensions`
+# parameter (1024-d float32 is 4 KB/vector vs 12 KB for full-size -large), via
+# --embedding-model/--embedding-dim — but only together with a matching change
+# on the generator side. None means the model's native dim.
+EMBEDDING_DIM = None
+
+def resolve_embedding_dim(model: str, dim: int | None) -> int:
+    full_dim = _EMBEDDING_DIM_MAP.get(model)
+    if full_dim is None:
+        raise SystemExit(f"Unknown embedding model: {model}")
+    if dim is None:
+        return full_dim
+    if dim > full_dim:
+        raise SystemExit(f"Requested embedding dim {dim} exceeds {model} native dim {full_dim}")
+    return dim
 
 ENCODING_NAME = "cl100k_base"
 CHUNK_TOKENS = 800
 CHUNK_OVERLAP = 100
 
 EMBED_BATCH = 16
+EMBED_CONCURRENCY = 8  # parallel in-flight embedding requests
 MAX_RETRIES = 5
 INITIAL_BACKOFF = 1.0  # seconds
 
@@ -82,10 +119,19 @@ def get_openai_client() -> OpenAI:
         raise RuntimeError("OPENAI_API_KEY not set. Please set it in environment or .env file.")
     return OpenAI(api_key=key)
 
+def get_async_openai_client() -> AsyncOpenAI:
+    key = os.getenv("OPENAI_API_KEY")
+    if not key:
+        raise RuntimeError("OPENAI_API_KEY not set. Please set it in environment or .env file.")
+    return AsyncOpenAI(api_key=key)
+
 _enc = tiktoken.get_encoding(ENCODING_NAME)
 
-def tokens_of(text: str) -> List[int]:
-    return _enc.encode(text)
+@functools.lru_cache(maxsize=100_000)
+def tokens_of(text: str) -> Tuple[int, ...]:
+    # titles and boilerplate repeat across blogs; cache hits skip the FFI call.
+    # tuples are hashable/immutable so cached values are safe to share.
+    return tuple(_enc.encode(text))
 
 def detokenize(tokens: List[int]) -> str:
     return _enc.decode(tokens)
@@ -93,21 +139,46 @@ def detokenize(tokens: List[int]) -> str:
 def chunk_tokens_to_texts(tokens: List[int], target_tokens: int = CHUNK_TOKENS, overlap: int = CHUNK_OVERLAP) -> List[Tuple[int,int,str]]:
     """
     Return list of (start_token, end_token, text) chunks for given tokens.
+    Spans are computed first so all windows decode in one batched call.
     """
     n = len(tokens)
     if n == 0:
         return []
-    chunks = []
+    spans: List[Tuple[int, int]] = []
     i = 0
     while i < n:
         j = min(i + target_tokens, n)
-        chunk_toks = tokens[i:j]
-        chunk_text = detokenize(chunk_toks)
-        chunks.append((i, j, chunk_text))
+        spans.append((i, j))
         if j >= n:
             break
         i = j - overlap
-    return chunks
+    texts = _enc.decode_batch([tokens[i:j] for i, j in spans], num_threads=os.cpu_count())
+    return [(i, j, text) for (i, j), text in zip(spans, texts)]
+
+_SENTENCE_BOUNDARY_RE = re.compile(r"[\n。.]")
+
+def _heading_sections(headings) -> List[Dict[str, Any]]:
+    """
+    Partition the document at the given headings in one document-order pass.
+    Each text node between a heading and the next becomes part of that
+    heading's section, so every node is visited exactly once regardless of
+    how many headings the file has.
+    """
+    sections = []
+    next_headings = headings[1:] + [None]
+    for h, nxt in zip(headings, next_headings):
+        title = h.get_text(separator=" ", strip=True)
+        parts = [title]
+        for node in h.next_elements:
+            if node is nxt:
+                break
+            # skip the heading's own text nodes (already captured as the title)
+            if isinstance(node, NavigableString) and h not in node.parents:
+                part = str(node).strip()
+                if part:
+                    parts.append(part)
+        sections.append({"title": title, "text": "\n".join(parts)})
+    return sections
 
 def html_file_to_sections(html_path: Path) -> List[Dict[str, Any]]:
     """
@@ -117,10 +188,10 @@ def html_file_to_sections(html_path: Path) -> List[Dict[str, Any]]:
       - Find all H2 elements; each H2 + following siblings until next H2 is a section.
       - If no H2: use H1 headings similarly.
       - If no H1/H2: take full body text and split into two token-balanced sections.
-    Returns list of dicts: {"title": str, "html_fragment": str, "text": str}
+    Returns list of dicts: {"title": str, "text": str}
     """
     raw = html_path.read_text(encoding="utf-8", errors="ignore")
-    soup = BeautifulSoup(raw, "html.parser")
+    soup = BeautifulSoup(raw, "lxml")
 
     # remove scripts/styles/comments/images
     for tag in soup(["script", "style", "noscript"]):
@@ -132,45 +203,14 @@ def html_file_to_sections(html_path: Path) -> List[Dict[str, Any]]:
 
     body = soup.body or soup
     # Collect H2 sections
-    sections: List[Dict[str, Any]] = []
     h2s = body.find_all(["h2"])
     if h2s:
-        for h2 in h2s:
-            title = h2.get_text(separator=" ", strip=True)
-            # collect siblings until next H2
-            content_parts = []
-            sibling = h2.next_sibling
-            while sibling:
-                # if sibling is a tag and is H2, stop
-                if getattr(sibling, "name", None) == "h2":
-                    break
-                # include the sibling HTML/text
-                content_parts.append(str(sibling))
-                sibling = sibling.next_sibling
-            fragment_html = f"<h2>{title}</h2>\n" + "\n".join(content_parts)
-            # extract readable text
-            frag_soup = BeautifulSoup(fragment_html, "html.parser")
-            text = frag_soup.get_text(separator="\n", strip=True)
-            sections.append({"title": title, "html_fragment": fragment_html, "text": text})
-        return sections
+        return _heading_sections(h2s)
 
     # fallback: H1 sections
     h1s = body.find_all(["h1"])
     if h1s:
-        for h1 in h1s:
-            title = h1.get_text(separator=" ", strip=True)
-            content_parts = []
-            sibling = h1.next_sibling
-            while sibling:
-                if getattr(sibling, "name", None) == "h1":
-                    break
-                content_parts.append(str(sibling))
-                sibling = sibling.next_sibling
-            fragment_html = f"<h1>{title}</h1>\n" + "\n".join(content_parts)
-            frag_soup = BeautifulSoup(fragment_html, "html.parser")
-            text = frag_soup.get_text(separator="\n", strip=True)
-            sections.append({"title": title, "html_fragment": fragment_html, "text": text})
-        return sections
+        return _heading_sections(h1s)
 
     # no headings -> split body text into two (token balanced)
     full_text = body.get_text(separator="\n", strip=True)
@@ -178,61 +218,193 @@ def html_file_to_sections(html_path: Path) -> List[Dict[str, Any]]:
     if len(toks) == 0:
         return []
     mid = len(toks) // 2
-    # ensure we split at nearest sentence boundary by decoding small windows
-    # find split token index by moving right until we find a punctuation/linebreak
+    # ensure we split at the nearest sentence boundary: decode the tail region
+    # once and regex-search it instead of decoding ~200 ten-token windows
     split_idx = mid
-    # attempt to move forward up to 200 tokens to find a linebreak char
-    for offset in range(0, min(200, len(toks)-mid)):
-        candidate = detokenize(toks[mid+offset:mid+offset+10])
-        if "\n" in candidate or "。" in candidate or "." in candidate:
-            split_idx = mid + offset
-            break
+    tail = detokenize(toks[mid:mid + 400])
+    m = _SENTENCE_BOUNDARY_RE.search(tail)
+    if m:
+        # re-encode the prefix up to the boundary for a token-accurate offset
+        split_idx = mid + len(tokens_of(tail[:m.end()]))
     sec1_toks = toks[:split_idx]
     sec2_toks = toks[split_idx:]
     sec1_text = detokenize(sec1_toks)
     sec2_text = detokenize(sec2_toks)
     return [
-        {"title": "بخش اول", "html_fragment": "", "text": sec1_text},
-        {"title": "بخش دوم", "html_fragment": "", "text": sec2_text},
+        {"title": "بخش اول", "text": sec1_text},
+        {"title": "بخش دوم", "text": sec2_text},
     ]
 
-def create_embeddings(client: OpenAI, texts: List[str], model: str = EMBEDDING_MODEL, batch_size: int = EMBED_BATCH) -> List[List[float]]:
-    embeddings: List[List[float]] = []
+def _parse_html_file(path: Path) -> List[Dict[str, Any]]:
+    """Worker-safe wrapper around html_file_to_sections: log per-file errors, keep going."""
+    try:
+        return html_file_to_sections(path)
+    except Exception as e:
+        logger.exception(f"Error processing file {path}: {e}")
+        return []
+
+async def create_embeddings(client: AsyncOpenAI, texts: List[str], model: str = EMBEDDING_MODEL, batch_size: int = EMBED_BATCH,
+                            concurrency: int = EMBED_CONCURRENCY, dimensions: int | None = None,
+                            checkpoint_path: Path | None = None) -> np.ndarray:
+    """
+    Embed all texts with up to `concurrency` batch requests in flight at once.
+    Each batch keeps its own retry/backoff loop so a throttled batch does not
+    stall the others; results land at fixed offsets to preserve input order.
+    Returns a pre-allocated (total, dim) float32 matrix filled in place.
+
+    If checkpoint_path is given, completed batches are persisted to a memmap
+    plus a sidecar JSON, so a rerun after a crash/429 storm only pays for the
+    batches that never finished.
+    """
     total = len(texts)
-    for start in range(0, total, batch_size):
-        batch = texts[start:start+batch_size]
+    dim = dimensions or _EMBEDDING_DIM_MAP.get(model)
+    if dim is None:
+        raise RuntimeError(f"Unknown embedding dimension for model: {model}")
+
+    state_path = checkpoint_path.with_suffix(".json") if checkpoint_path else None
+    done: set = set()
+    if checkpoint_path and checkpoint_path.exists() and state_path.exists():
+        try:
+            state = json.loads(state_path.read_text(encoding="utf-8"))
+            if state.get("total") == total and state.get("dim") == dim and state.get("model") == model:
+                done = set(state.get("done_batches", []))
+                logger.info(f"Resuming embeddings from checkpoint: {len(done)} batches already complete.")
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable embedding checkpoint {state_path}: {e}")
+            done = set()
+
+    if checkpoint_path:
+        mode = "r+" if (checkpoint_path.exists() and done) else "w+"
+        embeddings = np.memmap(checkpoint_path, dtype="float32", mode=mode, shape=(total, dim))
+    else:
+        embeddings = np.empty((total, dim), dtype="float32")
+    semaphore = asyncio.Semaphore(concurrency)
+
+    def record_batch_done(start: int):
+        done.add(start)
+        if checkpoint_path:
+            embeddings.flush()
+            state_path.write_text(json.dumps({"total": total, "dim": dim, "model": model,
+                                              "done_batches": sorted(done)}), encoding="utf-8")
+    # only text-embedding-3-* accept the truncation parameter
+    extra = {"dimensions": dimensions} if dimensions and model.startswith("text-embedding-3") else {}
+
+    async def embed_batch(start: int, batch: List[str]):
+        if start in done:
+            return
         last_exc = None
         for attempt in range(MAX_RETRIES):
             try:
-                resp = client.embeddings.create(model=model, input=batch)
+                async with semaphore:
+                    # base64 returns packed float32 bytes (~4 bytes/float on the
+                    # wire vs ~15-20 for decimal-string JSON floats)
+                    resp = await client.embeddings.create(model=model, input=batch,
+                                                          encoding_format="base64", **extra)
                 # resp.data is list corresponding to inputs
-                for item in resp.data:
-                    embeddings.append(list(item.embedding))
-                break
+                for offset, item in enumerate(resp.data):
+                    emb = item.embedding
+                    if isinstance(emb, str):
+                        emb = np.frombuffer(base64.b64decode(emb), dtype=np.float32)
+                    embeddings[start + offset] = emb
+                record_batch_done(start)
+                return
             except Exception as e:
                 last_exc = e
                 wait = INITIAL_BACKOFF * (2 ** attempt)
                 logger.warning(f"Embedding API error (attempt {attempt+1}/{MAX_RETRIES}): {e}. Retrying in {wait:.1f}s.")
-                time.sleep(wait)
-                continue
-        else:
-            raise RuntimeError(f"Failed creating embeddings after {MAX_RETRIES} attempts: {last_exc}")
-    if len(embeddings) != total:
-        raise RuntimeError(f"Embedding count mismatch: expected {total}, got {len(embeddings)}")
+                await asyncio.sleep(wait)
+        raise RuntimeError(f"Failed creating embeddings after {MAX_RETRIES} attempts: {last_exc}")
+
+    tasks = [embed_batch(start, texts[start:start+batch_size]) for start in range(0, total, batch_size)]
+    await asyncio.gather(*tasks)  # raises if any batch exhausted its retries
     return embeddings
 
-def build_faiss_index(vectors: np.ndarray, dim: int) -> faiss.Index:
-    faiss.normalize_L2(vectors)
-    index = faiss.IndexFlatIP(dim)
+if NUMBA_AVAILABLE:
+    @numba.njit(parallel=True, fastmath=True, cache=True)
+    def _normalize_rows_jit(v):
+        for i in numba.prange(v.shape[0]):
+            s = 0.0
+            for j in range(v.shape[1]):
+                s += v[i, j] * v[i, j]
+            inv = 1.0 / math.sqrt(s) if s > 0 else 0.0
+            for j in range(v.shape[1]):
+                v[i, j] *= inv
+
+def normalize_rows_inplace(vecs: np.ndarray) -> None:
+    """
+    L2-normalize matrix rows in place. With numba installed (optional) this
+    runs a fused multi-core kernel with no temporaries; otherwise it falls
+    back to the vectorized numpy path.
+    """
+    if NUMBA_AVAILABLE:
+        # the build hands us the checkpoint np.memmap; a base-class view via
+        # asarray shares its buffer, so the kernel still writes in place and
+        # ndarray subclasses no longer dodge the jit path
+        _normalize_rows_jit(np.asarray(vecs))
+        return
+    norms = np.linalg.norm(vecs, axis=1, keepdims=True)
+    np.divide(vecs, norms, out=vecs, where=norms > 0)
+
+DEFAULT_INDEX_TYPE = "auto"
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+IVFPQ_MIN_VECTORS = 10_000  # below this an exhaustive scan is faster than IVF probing
+IVFPQ_PQ_M = 64             # PQ sub-quantizers; must divide the embedding dim
+IVFPQ_TRAIN_CAP = 100_000   # training sample cap
+DEFAULT_NPROBE = 16
+
+def build_faiss_index(vectors: np.ndarray, dim: int, index_type: str = DEFAULT_INDEX_TYPE,
+                      nlist: int | None = None, nprobe: int = DEFAULT_NPROBE) -> faiss.Index:
+    """
+    Build the index; vectors must already be L2-normalized (inner product == cosine).
+    auto:     sq8 for small corpora, ivfpq once it pays off (>= IVFPQ_MIN_VECTORS)
+    flat:     exact float32 scan (baseline, 4*dim bytes/vector)
+    sq8:      int8 scalar quantization, 4x smaller and faster exact-ish scans
+    hnsw:     graph index, sub-linear search on float32 vectors
+    hnsw_sq8: graph index over int8-quantized vectors
+    ivfpq:    inverted lists + product quantization, sub-linear and compact
+    """
+    # C-contiguous float32 lets FAISS's SIMD kernels run without an internal copy
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    n = vectors.shape[0]
+    if index_type == "auto":
+        index_type = "ivfpq" if n >= IVFPQ_MIN_VECTORS else "sq8"
+        logger.info(f"Auto-selected index type '{index_type}' for {n} vectors.")
+    if index_type == "flat":
+        index = faiss.IndexFlatIP(dim)
+    elif index_type == "sq8":
+        index = faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT)
+        index.train(vectors)
+    elif index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    elif index_type == "hnsw_sq8":
+        index = faiss.IndexHNSWSQ(dim, faiss.ScalarQuantizer.QT_8bit, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        index.train(vectors)
+    elif index_type == "ivfpq":
+        if nlist is None:
+            nlist = max(1, int(4 * math.sqrt(n)))
+        quantizer = faiss.IndexFlatIP(dim)
+        index = faiss.IndexIVFPQ(quantizer, dim, nlist, IVFPQ_PQ_M, 8, faiss.METRIC_INNER_PRODUCT)
+        index.train(vectors[:min(n, IVFPQ_TRAIN_CAP)])
+        index.nprobe = nprobe
+    else:
+        raise ValueError(f"Unknown index type: {index_type}")
     index.add(vectors)
     return index
 
-def build_rag_from_html_folder(input_dir: Path, out_index_path: Path, out_meta_path: Path, env_file: Path | None = None):
+def build_rag_from_html_folder(input_dir: Path, out_index_path: Path, out_meta_path: Path, env_file: Path | None = None,
+                               embedding_model: str = EMBEDDING_MODEL, embedding_dim: int | None = EMBEDDING_DIM,
+                               index_type: str = DEFAULT_INDEX_TYPE, nlist: int | None = None,
+                               nprobe: int = DEFAULT_NPROBE):
     # load .env if provided
     if env_file:
         load_env_file(env_file)
 
-    client = get_openai_client()
+    embedding_dim = resolve_embedding_dim(embedding_model, embedding_dim)
+
+    client = get_async_openai_client()
 
     # collect html files
     files = sorted([p for p in input_dir.iterdir() if p.is_file() and p.suffix.lower() in (".html", ".htm")])
@@ -240,69 +412,99 @@ def build_rag_from_html_folder(input_dir: Path, out_index_path: Path, out_meta_p
         raise RuntimeError(f"No HTML files found in {input_dir}")
 
     logger.info(f"Found {len(files)} HTML files. Parsing and creating sections...")
-    all_chunks = []  # will hold metadata dicts
-    chunk_texts = []  # texts to embed
-
-    unique_id = 0
-    for file_idx, path in enumerate(files):
-        try:
-            sections = html_file_to_sections(path)
-            if not sections:
-                logger.warning(f"No text extracted from {path}; skipping.")
+    # parse is pure CPU with no cross-file state: fan out across processes,
+    # keep metadata assembly in the parent so ids stay deterministic
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as ex:
+        parsed = list(ex.map(_parse_html_file, files, chunksize=8))
+
+    section_entries = []  # (file_idx, path, sec_idx, sec, normalized_text)
+    for file_idx, (path, sections) in enumerate(zip(files, parsed)):
+        if not sections:
+            logger.warning(f"No text extracted from {path}; skipping.")
+            continue
+        for sec_idx, sec in enumerate(sections):
+            text = sec.get("text", "").strip()
+            if not text:
                 continue
-
-            for sec_idx, sec in enumerate(sections):
-                text = sec.get("text", "").strip()
-                if not text:
-                    continue
-                # normalize whitespace
-                text = "\n".join([ln.strip() for ln in text.splitlines() if ln.strip() != ""])
-                # chunk this section token-wise
-                toks = tokens_of(text)
-                chunks = chunk_tokens_to_texts(toks, target_tokens=CHUNK_TOKENS, overlap=CHUNK_OVERLAP)
-                # If section yields no chunks (very short), still create one chunk
-                if not chunks:
-                    chunks = [(0, len(toks), text)]
-                for chunk_idx, (start_t, end_t, chunk_text) in enumerate(chunks):
-                    meta = {
-                        "id": unique_id,
-                        "source_file": path.name,
-                        "file_index": file_idx,
-                        "section_index": sec_idx,
-                        "section_title": sec.get("title", "") or "",
-                        "chunk_index": chunk_idx,
-                        "start_token": int(start_t),
-                        "end_token": int(end_t),
-                        "text": chunk_text,
-                    }
-                    all_chunks.append(meta)
-                    chunk_texts.append(chunk_text)
-                    unique_id += 1
-        except Exception as e:
-            logger.exception(f"Error processing file {path}: {e}")
-
-    if not all_chunks:
+            # normalize whitespace
+            text = "\n".join([ln.strip() for ln in text.splitlines() if ln.strip() != ""])
+            section_entries.append((file_idx, path, sec_idx, sec, text))
+
+    # one Rust-side batch call for all sections (releases the GIL, threads internally)
+    section_tokens = _enc.encode_ordinary_batch([entry[4] for entry in section_entries],
+                                                num_threads=os.cpu_count())
+
+    # stream metadata JSONL to disk as chunks are assembled: each chunk text
+    # would otherwise be held twice (inside its meta dict and in the embed
+    # list) for the whole build, so peak RSS now scales with unique texts only
+    unique_texts = []  # deduplicated texts to embed
+    text_key_to_idx: Dict[bytes, int] = {}  # blake2b(text) -> row in unique_texts
+    chunk_unique_idx = []  # per chunk: which unique embedding row it maps to
+    n_chunks = 0
+    logger.info(f"Writing metadata JSONL to {out_meta_path} ...")
+    with out_meta_path.open("wb") as meta_f:
+        for (file_idx, path, sec_idx, sec, text), toks in zip(section_entries, section_tokens):
+            # chunk this section token-wise
+            chunks = chunk_tokens_to_texts(toks, target_tokens=CHUNK_TOKENS, overlap=CHUNK_OVERLAP)
+            # If section yields no chunks (very short), still create one chunk
+            if not chunks:
+                chunks = [(0, len(toks), text)]
+            for chunk_idx, (start_t, end_t, chunk_text) in enumerate(chunks):
+                meta = {
+                    "id": n_chunks,
+                    "source_file": path.name,
+                    "file_index": file_idx,
+                    "section_index": sec_idx,
+                    "section_title": sec.get("title", "") or "",
+                    "chunk_index": chunk_idx,
+                    "start_token": start_t,
+                    "end_token": end_t,
+                    "text": chunk_text,
+                }
+                # orjson emits UTF-8 bytes directly, no ensure_ascii pass
+                meta_f.write(orjson.dumps(meta, option=orjson.OPT_SERIALIZE_NUMPY) + b"\n")
+                # exact-duplicate texts (repeated boilerplate, overlap spans) get
+                # embedded once; hash keys keep the dict small for long chunks
+                key = hashlib.blake2b(chunk_text.encode("utf-8"), digest_size=16).digest()
+                uidx = text_key_to_idx.get(key)
+                if uidx is None:
+                    uidx = len(unique_texts)
+                    text_key_to_idx[key] = uidx
+                    unique_texts.append(chunk_text)
+                chunk_unique_idx.append(uidx)
+                n_chunks += 1
+
+    if n_chunks == 0:
         raise RuntimeError("No chunks produced from input files.")
 
-    logger.info(f"Created {len(all_chunks)} chunks total. Creating embeddings (model={EMBEDDING_MODEL})...")
-    embeddings = create_embeddings(client, chunk_texts, model=EMBEDDING_MODEL)
-    vecs = np.array(embeddings, dtype="float32")
-    if vecs.shape[1] != EMBEDDING_DIM:
-        raise RuntimeError(f"Embedding dimension mismatch: expected {EMBEDDING_DIM}, got {vecs.shape[1]}")
-
-    logger.info("Building FAISS index...")
-    index = build_faiss_index(vecs, EMBEDDING_DIM)
+    logger.info(f"Created {n_chunks} chunks total ({len(unique_texts)} unique texts). "
+                f"Creating embeddings (model={embedding_model}, dim={embedding_dim})...")
+    # checkpoint sits next to the index; removed once the build succeeds
+    checkpoint_path = out_index_path.with_suffix(".ckpt.npy")
+    uniq_vecs = asyncio.run(create_embeddings(client, unique_texts, model=embedding_model, dimensions=embedding_dim,
+                                              checkpoint_path=checkpoint_path))
+    if uniq_vecs.shape[1] != embedding_dim:
+        raise RuntimeError(f"Embedding dimension mismatch: expected {embedding_dim}, got {uniq_vecs.shape[1]}")
+
+    # L2-normalize once here while the matrix is hot, instead of a second
+    # full-matrix pass through faiss.normalize_L2 at index-build time
+    normalize_rows_inplace(uniq_vecs)
+
+    # scatter unique rows back to chunk order (fancy indexing is one memcpy);
+    # this also detaches the result from the checkpoint memmap
+    vecs = uniq_vecs[np.asarray(chunk_unique_idx)]
+
+    logger.info(f"Building FAISS index (type={index_type})...")
+    index = build_faiss_index(vecs, embedding_dim, index_type=index_type, nlist=nlist, nprobe=nprobe)
     logger.info(f"Saving FAISS index to {out_index_path} ...")
     faiss.write_index(index, str(out_index_path))
 
-    # write metadata as JSONL
-    logger.info(f"Writing metadata JSONL to {out_meta_path} ...")
-    with out_meta_path.open("w", encoding="utf-8") as f:
-        for meta in all_chunks:
-            f.write(json.dumps(meta, ensure_ascii=False) + "\n")
+    # build finished; the embedding checkpoint is no longer needed
+    checkpoint_path.unlink(missing_ok=True)
+    checkpoint_path.with_suffix(".json").unlink(missing_ok=True)
 
     logger.info("RAG build complete.")
-    logger.info(f"Index: {out_index_path}  Metadata: {out_meta_path}  Chunks: {len(all_chunks)}")
+    logger.info(f"Index: {out_index_path}  Metadata: {out_meta_path}  Chunks: {n_chunks}")
 
 def parse_args():
     p = argparse.ArgumentParser(description="Build section-aware RAG from HTML blog files.")
@@ -310,6 +512,14 @@ def parse_args():
     p.add_argument("--out-index", default=DEFAULT_INDEX_PATH, help="Output FAISS index path.")
     p.add_argument("--out-meta", default=DEFAULT_META_PATH, help="Output metadata JSONL path.")
     p.add_argument("--env", default=".env", help="Optional .env path to load OPENAI_API_KEY (or set env var).")
+    p.add_argument("--embedding-model", default=EMBEDDING_MODEL, help="OpenAI embedding model.")
+    p.add_argument("--embedding-dim", type=int, default=EMBEDDING_DIM,
+                   help="Embedding dimensions (text-embedding-3-* only; truncated server-side).")
+    p.add_argument("--index-type", choices=("auto", "flat", "sq8", "hnsw", "hnsw_sq8", "ivfpq"),
+                   default=DEFAULT_INDEX_TYPE,
+                   help="FAISS index layout (auto picks sq8 for small corpora, ivfpq for large).")
+    p.add_argument("--nlist", type=int, default=None, help="IVF list count (ivfpq; default 4*sqrt(N)).")
+    p.add_argument("--nprobe", type=int, default=DEFAULT_NPROBE, help="IVF lists probed per query (ivfpq).")
     return p.parse_args()
 
 def main():
@@ -322,7 +532,9 @@ def main():
     try:
         if env_path and env_path.exists():
             load_env_file(env_path)
-        build_rag_from_html_folder(input_dir=input_dir, out_index_path=out_index, out_meta_path=out_meta, env_file=env_path)
+        build_rag_from_html_folder(input_dir=input_dir, out_index_path=out_index, out_meta_path=out_meta, env_file=env_path,
+                                   embedding_model=args.embedding_model, embedding_dim=args.embedding_dim,
+                                   index_type=args.index_type, nlist=args.nlist, nprobe=args.nprobe)
     except Exception as e:
         logger.exception("Failed to build RAG: %s", e)
         sys.exit(1)
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+
+from __future__ import annotations
+import sys
+import argparse
+import logging
+from pathlib import Path
+
+try:
+    import faiss
+except Exception:
+    raise SystemExit("Install faiss-cpu: pip install faiss-cpu")
+
+LOG = logging.getLogger("faiss_convert")
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+DEFAULT_HNSW_M = 32
+DEFAULT_EF_CONSTRUCTION = 200
+INDEX_TYPES = ("hnsw", "sq_fp16", "hnsw_sq_fp16")
+
+def companion_path_for(index_path: Path, index_type: str) -> Path:
+    """Companion index path for a flat index (rag_sections.faiss -> rag_sections_hnsw.faiss etc)."""
+    return index_path.with_name(index_path.stem + "_" + index_type + index_path.suffix)
+
+def convert_index(in_path: Path, out_path: Path, index_type: str = "hnsw", m: int = DEFAULT_HNSW_M,
+                  ef_construction: int = DEFAULT_EF_CONSTRUCTION) -> Path:
+    """
+    One-time offline conversion of a flat index.
+    hnsw:         IndexHNSWFlat — sub-linear graph search on float32 vectors
+    sq_fp16:      IndexScalarQuantizer fp16 — half the bytes, so the
+                  bandwidth-bound flat scan runs ~2x faster at <1% recall loss
+    hnsw_sq_fp16: graph search over fp16-quantized vectors (compounded)
+    Vectors are copied out of the source index unchanged, so cosine ranking on
+    L2-normalized embeddings is preserved.
+    """
+    if not in_path.exists():
+        raise FileNotFoundError(f"FAISS index file not found: {in_path}")
+    index = faiss.read_index(str(in_path))
+    LOG.info("Loaded %s: %d vectors, dim=%d", in_path, index.ntotal, index.d)
+    xb = index.reconstruct_n(0, index.ntotal)
+    if index_type == "hnsw":
+        out = faiss.IndexHNSWFlat(index.d, m, faiss.METRIC_INNER_PRODUCT)
+        out.hnsw.efConstruction = ef_construction
+    elif index_type == "sq_fp16":
+        out = faiss.IndexScalarQuantizer(index.d, faiss.ScalarQuantizer.QT_fp16, faiss.METRIC_INNER_PRODUCT)
+        out.train(xb)
+    elif index_type == "hnsw_sq_fp16":
+        out = faiss.IndexHNSWSQ(index.d, faiss.ScalarQuantizer.QT_fp16, m, faiss.METRIC_INNER_PRODUCT)
+        out.hnsw.efConstruction = ef_construction
+        out.train(xb)
+    else:
+        raise ValueError(f"Unknown index type: {index_type}")
+    out.add(xb)
+    faiss.write_index(out, str(out_path))
+    LOG.info("%s index written to %s", index_type, out_path)
+    return out_path
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Convert a flat FAISS index to HNSW for faster retrieval.")
+    p.add_argument("--index", "-i", default="rag_sections.faiss", help="Input FAISS index path.")
+    p.add_argument("--out", "-o", default=None, help="Output path (default: <index>_<type>.faiss).")
+    p.add_argument("--type", "-t", choices=INDEX_TYPES, default="hnsw", help="Target index layout.")
+    p.add_argument("--m", type=int, default=DEFAULT_HNSW_M, help="HNSW graph degree.")
+    p.add_argument("--ef-construction", type=int, default=DEFAULT_EF_CONSTRUCTION,
+                   help="HNSW efConstruction (build-time accuracy/speed tradeoff).")
+    return p.parse_args()
+
+def main():
+    args = parse_args()
+    in_path = Path(args.index)
+    out_path = Path(args.out) if args.out else companion_path_for(in_path, args.type)
+    try:
+        convert_index(in_path, out_path, index_type=args.type, m=args.m, ef_construction=args.ef_construction)
+    except Exception as e:
+        LOG.exception("Conversion failed: %s", e)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -2,31 +2,59 @@
 
 from __future__ import annotations
 import os
+import io
 import sys
 import json
 import time
 import re
+import mmap
+import pickle
+import asyncio
+import sqlite3
+import hashlib
 import argparse
 import logging
+import random
+import functools
+import threading
 from pathlib import Path
 from typing import List, Dict, Any, Tuple, Optional
 
 # third-party
 try:
-    from openai import OpenAI
+    import openai
+    from openai import OpenAI, AsyncOpenAI
 except Exception:
     raise SystemExit("Install openai (new v1+ client): pip install openai")
 
+try:
+    import httpx
+except Exception:
+    raise SystemExit("Install httpx (ships with openai): pip install httpx[http2]")
+
+try:
+    from pydantic import BaseModel
+except Exception:
+    raise SystemExit("Install pydantic (ships with openai): pip install pydantic")
+
 try:
     import tiktoken
 except Exception:
     raise SystemExit("Install tiktoken: pip install tiktoken")
 
+try:
+    import orjson
+except Exception:
+    raise SystemExit("Install orjson: pip install orjson")
+
 try:
     import faiss
 except Exception:
     raise SystemExit("Install faiss-cpu: pip install faiss-cpu")
 
+# parallel row scanning inside index.search; leave headroom for the process
+faiss.omp_set_num_threads(max(1, (os.cpu_count() or 2) // 2))
+
 try:
     from dotenv import load_dotenv
     DOTENV = True
@@ -54,9 +82,34 @@ RETRIEVE_MULT = 8  # multiply to get more candidates
 SUMMARIZE_MAX_TOKENS = 500  # Increased for better summaries
 API_RETRY = 5  # Increased retry attempts
 API_BACKOFF_BASE = 1.0
+API_BACKOFF_CAP = 60.0  # never sleep longer than this between attempts
+
+# client-side errors that retrying cannot fix; re-raise instead of burning
+# the whole backoff schedule on them
+_NON_RETRYABLE_ERRORS = tuple(
+    exc for exc in (getattr(openai, name, None)
+                    for name in ("BadRequestError", "AuthenticationError",
+                                 "PermissionDeniedError", "NotFoundError",
+                                 "UnprocessableEntityError"))
+    if exc is not None)
+
+def _retry_wait(attempt: int) -> float:
+    """Capped exponential backoff with full jitter, so concurrent runs that
+    hit a rate limit together don't all retry in lockstep."""
+    return min(API_BACKOFF_CAP, API_BACKOFF_BASE * (2 ** attempt)) * (0.5 + random.random())
+
+def _check_retryable(exc: Exception) -> None:
+    """Re-raise errors a retry can't fix (bad request, auth, ...)."""
+    if isinstance(exc, _NON_RETRYABLE_ERRORS):
+        raise exc
+EMBED_BATCH_SIZE = 64  # OpenAI accepts up to 2048 inputs; bigger batches amortize HTTP/TLS overhead
+EMBED_CONCURRENCY = 8  # parallel in-flight embedding requests on the multi-batch path
 MIN_WORD_COUNT = 1500  # Increased minimum word count
-ENHANCED_CONTENT_GENERATION = True  # Enable enhanced content strategies
 CONTENT_QUALITY_THRESHOLD = 0.8  # Quality threshold for content validation
+CONTEXT_CHAR_BUDGET = 40_000  # cap on retrieved context pasted into a prompt
+PHASE2_TARGET_WORDS = 1200  # the Phase 2 prompt asks for 1000-1200 new words
+PERSIAN_WORDS_PER_TOKEN = 0.55  # rough Persian words-per-token ratio
+PHASE2_TOKEN_BUDGET = int(PHASE2_TARGET_WORDS / PERSIAN_WORDS_PER_TOKEN * 1.2)  # +20% headroom
 DIVERSITY_WEIGHT = 0.3  # Weight for content diversity
 RELEVANCE_WEIGHT = 0.7  # Weight for content relevance
 
@@ -182,54 +235,427 @@ def load_env(env_path: Optional[Path]):
                         os.environ.setdefault(k.strip(), v.strip().strip('"').strip("'"))
             LOG.info("Loaded .env (simple parser) from %s", env_path)
 
-def get_openai_client() -> OpenAI:
+def _require_api_key() -> str:
     key = os.getenv("OPENAI_API_KEY")
     if not key:
         raise RuntimeError("OPENAI_API_KEY not found in environment. Provide via .env or env var.")
-    return OpenAI(api_key=key)
+    return key
+
+# connection pool shared by every request the process makes: keep-alive
+# amortizes TCP/TLS setup, HTTP/2 multiplexes concurrent requests over one
+# connection instead of opening a socket per in-flight call
+_HTTP_LIMITS = httpx.Limits(max_keepalive_connections=32, max_connections=64)
+_HTTP_TIMEOUT = 60
+
+_client: Optional[OpenAI] = None
+_async_client: Optional[AsyncOpenAI] = None
+_async_client_loop: Optional[asyncio.AbstractEventLoop] = None
+
+def get_openai_client() -> OpenAI:
+    global _client
+    if _client is None:
+        _client = OpenAI(api_key=_require_api_key(),
+                         http_client=httpx.Client(http2=True, limits=_HTTP_LIMITS,
+                                                  timeout=_HTTP_TIMEOUT))
+    return _client
+
+def get_async_openai_client() -> AsyncOpenAI:
+    # One client per event loop, not per process: the pipeline calls
+    # asyncio.run several times back-to-back, and keep-alive connections
+    # pooled under a closed loop fail the next request with "Event loop is
+    # closed". Must be called from inside a running loop.
+    global _async_client, _async_client_loop
+    loop = asyncio.get_running_loop()
+    if _async_client is None or _async_client_loop is not loop:
+        _async_client = AsyncOpenAI(api_key=_require_api_key(),
+                                    http_client=httpx.AsyncClient(http2=True, limits=_HTTP_LIMITS,
+                                                                  timeout=_HTTP_TIMEOUT))
+        _async_client_loop = loop
+    return _async_client
 
 _enc = tiktoken.get_encoding(ENCODING_NAME)
 
-def embed_text(client: OpenAI, texts: List[str], model: str = EMBEDDING_MODEL) -> List[List[float]]:
-    out = []
-    batch_size = 16
-    for i in range(0, len(texts), batch_size):
-        batch = texts[i:i+batch_size]
+@functools.lru_cache(maxsize=8192)
+def count_tokens(text: str) -> int:
+    """Token count with memoization — BPE encoding is CPU-heavy for repeated strings."""
+    return len(_enc.encode(text))
+
+# the static prompt blocks are re-sent with every request; count them once at
+# import so per-call budget math never re-encodes them
+RULES_BLOCK_TOKENS = count_tokens(RULES_BLOCK)
+EXAMPLES_BLOCK_TOKENS = count_tokens(EXAMPLES_BLOCK)
+
+# account-level limits; override per deployment via env
+DEFAULT_TPM_LIMIT = int(os.environ.get("OPENAI_TPM_LIMIT", "2000000"))
+DEFAULT_RPM_LIMIT = int(os.environ.get("OPENAI_RPM_LIMIT", "5000"))
+
+class RateLimiter:
+    """
+    Pre-emptive TPM/RPM budgeting: instead of reacting to 429s with blind
+    exponential backoff (1-32s of dead sleep per collision), estimate each
+    request's token cost up front and wait only as long as it takes the
+    budget to refill. Buckets refill continuously at limit/60 per second on
+    the monotonic clock.
+    """
+    def __init__(self, tpm: int = DEFAULT_TPM_LIMIT, rpm: int = DEFAULT_RPM_LIMIT):
+        self._tpm = tpm
+        self._rpm = rpm
+        self._tokens = float(tpm)
+        self._requests = float(rpm)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self, estimated_tokens: int) -> float:
+        """Debit one request + estimated_tokens; return seconds until both budgets cover it."""
+        with self._lock:
+            now = time.monotonic()
+            elapsed = now - self._last
+            self._last = now
+            self._tokens = min(float(self._tpm), self._tokens + elapsed * self._tpm / 60.0)
+            self._requests = min(float(self._rpm), self._requests + elapsed * self._rpm / 60.0)
+            wait = 0.0
+            if self._tokens < estimated_tokens:
+                wait = (estimated_tokens - self._tokens) * 60.0 / self._tpm
+            if self._requests < 1.0:
+                wait = max(wait, (1.0 - self._requests) * 60.0 / self._rpm)
+            self._tokens -= estimated_tokens
+            self._requests -= 1.0
+            return wait
+
+    def acquire(self, estimated_tokens: int) -> None:
+        wait = self._reserve(estimated_tokens)
+        if wait > 0:
+            LOG.info("Rate limit budget exhausted; waiting %.1fs before next request", wait)
+            time.sleep(wait)
+
+    async def acquire_async(self, estimated_tokens: int) -> None:
+        wait = self._reserve(estimated_tokens)
+        if wait > 0:
+            LOG.info("Rate limit budget exhausted; waiting %.1fs before next request", wait)
+            await asyncio.sleep(wait)
+
+_rate_limiter = RateLimiter()
+
+def _estimate_chat_tokens(messages: List[Dict[str, str]], max_tokens: int) -> int:
+    return sum(count_tokens(m["content"]) for m in messages) + max_tokens
+
+DEFAULT_EMBED_CACHE_PATH = "embed_cache.sqlite3"
+
+class EmbedCache:
+    """
+    Persistent embedding cache: sha256(model|text) -> vector blob. Turns a
+    repeat embedding network call (~100-300ms, billed) into a local sqlite
+    read. Vectors are stored as fp16 — half the bytes on disk and through the
+    page cache, negligible recall change for cosine ranking — and widened back
+    to float32 on read, which FAISS expects at search time.
+    """
+    def __init__(self, path: str = DEFAULT_EMBED_CACHE_PATH):
+        # the phased pipeline reads the cache from asyncio.to_thread workers
+        # as well as the main thread; sqlite connections are not thread-safe,
+        # so share one connection behind a lock (same pattern as RateLimiter)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # emb_fp16 supersedes the old float32 `emb` table; old entries are
+        # simply re-embedded on miss rather than migrated
+        self._conn.execute("CREATE TABLE IF NOT EXISTS emb_fp16 (hash TEXT PRIMARY KEY, vec BLOB)")
+        self._conn.commit()
+
+    @staticmethod
+    def _key(model: str, text: str) -> str:
+        return hashlib.sha256((model + "|" + text).encode("utf-8")).hexdigest()
+
+    def get(self, model: str, text: str) -> Optional[np.ndarray]:
+        with self._lock:
+            row = self._conn.execute("SELECT vec FROM emb_fp16 WHERE hash = ?",
+                                     (self._key(model, text),)).fetchone()
+        if row is None:
+            return None
+        return np.frombuffer(row[0], dtype=np.float16).astype(np.float32)
+
+    def put(self, model: str, text: str, vec) -> None:
+        blob = np.asarray(vec, dtype=np.float16).tobytes()
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO emb_fp16 (hash, vec) VALUES (?, ?)",
+                               (self._key(model, text), blob))
+            self._conn.commit()
+
+_embed_cache: Optional[EmbedCache] = None
+_embed_cache_init_lock = threading.Lock()
+
+def get_embed_cache() -> EmbedCache:
+    global _embed_cache
+    if _embed_cache is None:
+        # two to_thread workers can race here on first use; without the lock
+        # each would open its own connection and one cache would be leaked
+        with _embed_cache_init_lock:
+            if _embed_cache is None:
+                _embed_cache = EmbedCache()
+    return _embed_cache
+
+def embed_text(client: OpenAI, texts: List[str], model: str = EMBEDDING_MODEL,
+               out: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Embed texts into a contiguous (n, dim) float32 matrix, via the cache.
+    When a correctly-shaped `out` buffer is passed, rows are copied into it
+    and no new matrix is allocated.
+    """
+    if not texts:
+        # vstack/out-copy below can't produce an empty matrix; short-circuit
+        return np.empty((0, EMBEDDING_DIM or 0), dtype=np.float32)
+    cache = get_embed_cache()
+    rows: List[Optional[np.ndarray]] = [None] * len(texts)
+    pending: List[str] = []
+    pending_idx: List[int] = []
+    for i, text in enumerate(texts):
+        vec = cache.get(model, text)
+        if vec is not None:
+            rows[i] = vec
+        else:
+            pending.append(text)
+            pending_idx.append(i)
+    if pending:
+        if len(pending) <= EMBED_BATCH_SIZE:
+            fresh = _embed_batch_sync(client, pending, model)
+        else:
+            # multiple batches: overlap the network round-trips instead of paying them serially
+            fresh = asyncio.run(_embed_batches_async(pending, model))
+        for j, (i, text) in enumerate(zip(pending_idx, pending)):
+            cache.put(model, text, fresh[j])
+            rows[i] = fresh[j]
+    if out is not None and rows and out.shape == (len(rows), rows[0].shape[-1]):
+        for i, vec in enumerate(rows):
+            out[i] = vec
+        return out
+    # vstack copies the cached read-only rows into one writable float32 matrix
+    return np.vstack(rows)
+
+def _embed_batch_sync(client: OpenAI, batch: List[str], model: str) -> np.ndarray:
+    last_exc = None
+    for attempt in range(API_RETRY):
+        try:
+            _rate_limiter.acquire(sum(count_tokens(t) for t in batch))
+            resp = client.embeddings.create(model=model, input=batch)
+            # straight into float32 — list(item.embedding) would allocate
+            # thousands of PyFloats per vector just to throw them away
+            return np.asarray([item.embedding for item in resp.data], dtype=np.float32)
+        except Exception as e:
+            last_exc = e
+            _check_retryable(e)
+            wait = _retry_wait(attempt)
+            LOG.warning("Embedding attempt %d failed: %s — retrying in %.1fs", attempt + 1, e, wait)
+            time.sleep(wait)
+    raise RuntimeError(f"Failed embedding batch after retries: {last_exc}")
+
+async def _embed_batches_async(texts: List[str], model: str) -> np.ndarray:
+    client = get_async_openai_client()
+    out: List[Optional[np.ndarray]] = [None] * ((len(texts) + EMBED_BATCH_SIZE - 1) // EMBED_BATCH_SIZE)
+    semaphore = asyncio.Semaphore(EMBED_CONCURRENCY)
+
+    async def embed_batch(batch_no: int, batch: List[str]):
         last_exc = None
         for attempt in range(API_RETRY):
             try:
-                resp = client.embeddings.create(model=model, input=batch)
-                for item in resp.data:
-                    out.append(list(item.embedding))
-                break
+                async with semaphore:
+                    await _rate_limiter.acquire_async(sum(count_tokens(t) for t in batch))
+                    resp = await client.embeddings.create(model=model, input=batch)
+                out[batch_no] = np.asarray([item.embedding for item in resp.data], dtype=np.float32)
+                return
             except Exception as e:
                 last_exc = e
-                wait = API_BACKOFF_BASE * (2 ** attempt)
+                _check_retryable(e)
+                wait = _retry_wait(attempt)
                 LOG.warning("Embedding attempt %d failed: %s — retrying in %.1fs", attempt + 1, e, wait)
-                time.sleep(wait)
-        else:
-            raise RuntimeError(f"Failed embedding batch after retries: {last_exc}")
-    return out
+                await asyncio.sleep(wait)
+        raise RuntimeError(f"Failed embedding batch after retries: {last_exc}")
 
-def embed_query(client: OpenAI, query: str, model: str = EMBEDDING_MODEL) -> List[float]:
-    return embed_text(client, [query], model=model)[0]
+    await asyncio.gather(*[embed_batch(batch_no, texts[i:i+EMBED_BATCH_SIZE])
+                           for batch_no, i in enumerate(range(0, len(texts), EMBED_BATCH_SIZE))])
+    return np.concatenate(out)
+
+def embed_query(client: OpenAI, query: str, model: str = EMBEDDING_MODEL) -> np.ndarray:
+    # the same query string is re-embedded across structure/phase1/phase2 calls
+    return _embed_query_cached(client, query, model)
+
+@functools.lru_cache(maxsize=4096)
+def _embed_query_cached(client: OpenAI, query: str, model: str) -> np.ndarray:
+    # frozen so the cached row can't be mutated by a caller (e.g. normalize_L2)
+    vec = embed_text(client, [query], model=model)[0]
+    vec.setflags(write=False)
+    return vec
 
 def load_meta_jsonl(path: Path) -> List[Dict[str, Any]]:
     if not path.exists():
         raise FileNotFoundError(f"Metadata file not found: {path}")
-    meta = []
-    with path.open("r", encoding="utf-8") as f:
-        for ln in f:
-            ln = ln.strip()
-            if not ln:
-                continue
-            meta.append(json.loads(ln))
+    # a pickle sidecar skips the per-record JSON parse on every run after the
+    # first; gated on mtime so regenerating the jsonl invalidates it
+    cache_path = path.with_suffix(".pkl")
+    if cache_path.exists() and cache_path.stat().st_mtime >= path.stat().st_mtime:
+        try:
+            with cache_path.open("rb") as f:
+                return pickle.load(f)
+        except Exception as e:
+            LOG.warning("Ignoring unreadable meta cache %s: %s", cache_path, e)
+    # mmap the whole file, materialize the mapped pages as one bytes object
+    # (mmap itself has no split) and split lines in C; orjson parses each
+    # record far faster than stdlib json, which matters for tens of
+    # thousands of chunks
+    with path.open("rb") as f:
+        if path.stat().st_size == 0:
+            return []
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            meta = [orjson.loads(ln) for ln in bytes(mm).split(b"\n") if ln.strip()]
+    try:
+        with cache_path.open("wb") as f:
+            pickle.dump(meta, f, protocol=pickle.HIGHEST_PROTOCOL)
+    except Exception as e:
+        LOG.warning("Could not write meta cache %s: %s", cache_path, e)
     return meta
 
+# companion indexes produced by faiss_convert.py, in preference order:
+# graph+fp16 beats graph which beats a half-width flat scan
+INDEX_COMPANION_TYPES = ("hnsw_sq_fp16", "hnsw", "sq_fp16")
+
+# mmap the index instead of reading it onto the heap: startup stops paying a
+# full-file read, and the OS page cache shares the pages across successive
+# generation runs. Flags are version-dependent, so probe for them.
+_INDEX_IO_FLAGS = getattr(faiss, "IO_FLAG_MMAP", 0) | getattr(faiss, "IO_FLAG_READ_ONLY", 0)
+
+def _read_index(path: Path) -> faiss.Index:
+    """
+    Read an index memory-mapped and read-only when the installed FAISS
+    supports it, so the kernel pages in only the vectors a search touches
+    instead of pinning the whole file in RAM. mmap only works for on-disk
+    layouts FAISS can map directly (Flat/IVF-Flat style); anything else
+    falls back to a plain heap read.
+    """
+    if _INDEX_IO_FLAGS:
+        try:
+            return faiss.read_index(str(path), _INDEX_IO_FLAGS)
+        except Exception as e:
+            LOG.warning("mmap load failed for %s (%s); reading into heap", path, e)
+    return faiss.read_index(str(path))
+
+DEFAULT_NPROBE = 16  # IVF cells probed per query; recall/speed knob
+
+def _tune_index(index: faiss.Index) -> faiss.Index:
+    """Apply per-type search-time knobs to a freshly loaded index."""
+    if hasattr(index, "hnsw"):
+        index.hnsw.efSearch = max(64, RETRIEVE_TOP_K * 4)
+    try:
+        ivf = faiss.extract_index_ivf(index)
+    except Exception:
+        ivf = None
+    if ivf is not None:
+        # IVF scans nprobe/nlist of the corpus instead of all of it; the
+        # index ships with whatever nprobe it was built with, so set ours
+        ivf.nprobe = DEFAULT_NPROBE
+        LOG.info("IVF index: nlist=%d, nprobe=%d", ivf.nlist, ivf.nprobe)
+    return index
+
+def _check_index_dim(index: faiss.Index, path: Path) -> faiss.Index:
+    # fail at load time with a clear message instead of a FAISS assertion at
+    # search time — an index built with a different model/dim (see
+    # build_rag_sections.py --embedding-model/--embedding-dim) cannot be
+    # queried with this module's embeddings
+    if EMBEDDING_DIM and index.d != EMBEDDING_DIM:
+        raise RuntimeError(
+            f"Index {path} has dim {index.d} but {EMBEDDING_MODEL} queries are "
+            f"{EMBEDDING_DIM}-d; rebuild the index with the matching embedding "
+            "model/dim (build_rag_sections.py defaults match this module).")
+    return index
+
 def load_faiss_index(path: Path) -> faiss.Index:
+    # prefer a converted companion: graph search is sub-linear and fp16
+    # quantization halves the bytes scanned per query. A companion older than
+    # the primary index predates a rebuild and holds stale vectors, so it is
+    # skipped until faiss_convert.py is re-run.
+    primary_mtime = path.stat().st_mtime if path.exists() else None
+    for companion_type in INDEX_COMPANION_TYPES:
+        companion = path.with_name(path.stem + "_" + companion_type + path.suffix)
+        if companion.exists():
+            if primary_mtime is not None and companion.stat().st_mtime < primary_mtime:
+                LOG.warning("Skipping stale %s index %s (older than %s; re-run faiss_convert.py)",
+                            companion_type, companion, path)
+                continue
+            LOG.info("Using %s index %s", companion_type, companion)
+            return _tune_index(_check_index_dim(_read_index(companion), companion))
     if not path.exists():
         raise FileNotFoundError(f"FAISS index file not found: {path}")
-    return faiss.read_index(str(path))
+    return _tune_index(_check_index_dim(_read_index(path), path))
+
+# keyed by id(meta) but the entry also pins the list itself: lists can't be
+# weakref'd, and without the strong reference a collected list could hand its
+# address to a new one and serve it a stale id array. A run loads one or two
+# meta lists, so pinning them costs nothing.
+_meta_ids_cache: Dict[int, Tuple[List[Dict[str, Any]], np.ndarray]] = {}
+
+def _meta_id_array(meta: List[Dict[str, Any]]) -> np.ndarray:
+    """
+    Per-chunk ids aligned with meta as an int64 vector, built once per loaded
+    meta list. Non-integer ids are hashed so the dedup below can stay in numpy.
+    """
+    entry = _meta_ids_cache.get(id(meta))
+    if entry is not None and entry[0] is meta:
+        return entry[1]
+    arr = np.fromiter((hash(m.get("id")) for m in meta), dtype=np.int64, count=len(meta))
+    _meta_ids_cache[id(meta)] = (meta, arr)
+    return arr
+
+def _dedup_row(meta: List[Dict[str, Any]], meta_ids: np.ndarray, scores, idxs,
+               top_k: int) -> List[Tuple[Dict[str, Any], float]]:
+    """
+    Keep unique chunks by id from one search row, preserving score order.
+    FAISS returns each row score-sorted, so first occurrence in position order
+    is the best-scoring hit per id; np.unique finds those first occurrences in
+    C instead of a Python loop over N candidates.
+    """
+    valid = (idxs >= 0) & (idxs < len(meta))
+    idxs = idxs[valid]
+    scores = scores[valid]
+    _, first = np.unique(meta_ids[idxs], return_index=True)
+    first.sort()
+    return [(meta[int(idxs[j])], float(scores[j])) for j in first[:top_k]]
+
+# scratch matrix for query embeddings, reused across retrievals; 32 rows is
+# comfortably more than any per-section batch this pipeline issues. Dimension
+# mismatches (non-default embedding model) just fall back to a fresh matrix.
+# The Phase 1 / Phase 2 prefetch overlap can run two retrievals at once, so
+# the buffer is claimed with a non-blocking lock: the loser of the race
+# allocates a fresh matrix instead of scribbling over the winner's rows.
+_QUERY_BUF = np.empty((32, EMBEDDING_DIM or 3072), dtype=np.float32)
+_QUERY_BUF_LOCK = threading.Lock()
+
+def retrieve_batch(client: OpenAI, index: faiss.Index, meta: List[Dict[str, Any]],
+                   queries: List[str], top_k: int = RETRIEVE_TOP_K) -> List[List[Tuple[Dict[str,Any], float]]]:
+    """
+    Retrieve top_k chunks for several queries with one embedding call and one
+    FAISS search. A single (B, dim) search hits FAISS's batched BLAS path,
+    which is much faster than B separate one-row searches.
+    """
+    own_buf = len(queries) <= _QUERY_BUF.shape[0] and _QUERY_BUF_LOCK.acquire(blocking=False)
+    try:
+        if own_buf:
+            # reuse the warm module-level block: no 12KB-per-row allocation, and
+            # the alignment FAISS's SIMD kernels want
+            Q = embed_text(client, queries, out=_QUERY_BUF[:len(queries)])
+        else:
+            Q = embed_text(client, queries)
+        faiss.normalize_L2(Q)
+        meta_ids = _meta_id_array(meta)
+        # ask for a dedup-proof candidate pool up front: one search over the full
+        # index instead of up to three, each of which re-scanned every vector
+        N = max(1, min(len(meta), top_k * RETRIEVE_MULT * 2))
+        D, I = index.search(Q, N)
+    finally:
+        if own_buf:
+            # search copied what it needed into D/I; the buffer is free again
+            _QUERY_BUF_LOCK.release()
+    results = [_dedup_row(meta, meta_ids, D[row], I[row], top_k) for row in range(len(queries))]
+    for query, row_results in zip(queries, results):
+        if len(row_results) < top_k:
+            LOG.warning("Insufficient retrieval results for query '%s'; returning %d", query, len(row_results))
+    return results
 
 def retrieve_top_k(client: OpenAI, index: faiss.Index, meta: List[Dict[str, Any]],
                    query: str, top_k: int = RETRIEVE_TOP_K) -> List[Tuple[Dict[str,Any], float]]:
@@ -237,41 +663,99 @@ def retrieve_top_k(client: OpenAI, index: faiss.Index, meta: List[Dict[str, Any]
     Retrieve top_k chunks globally for the query.
     Searches for N = top_k * RETRIEVE_MULT, keeps unique by id, ordered by score desc.
     """
-    vec = np.array([embed_query(client, query)], dtype="float32")
-    faiss.normalize_L2(vec)
-    N = top_k * RETRIEVE_MULT
-    max_N = min(len(meta), top_k * 20)
-    attempts = 0
-    while attempts < 3:
-        D, I = index.search(vec, N)
-        candidates = []
-        for score, idx in zip(D[0], I[0]):
-            if idx < 0 or idx >= len(meta):
-                continue
-            m = meta[idx]
-            candidates.append((m, float(score)))
-        # keep unique by chunk id and preserve order by score
-        seen = set()
-        filtered = []
-        for m, s in candidates:
-            cid = m.get("id")
-            if cid in seen:
-                continue
-            seen.add(cid)
-            filtered.append((m, s))
-        results = filtered[:top_k]
-        if len(results) >= top_k:
-            return results
-        # increase N
-        attempts += 1
-        N = min(max_N, N * 2)
-    LOG.warning("Insufficient retrieval results for query '%s'; returning %d", query, len(results))
-    return results
+    return retrieve_batch(client, index, meta, [query], top_k=top_k)[0]
+
+# response-parsing patterns, compiled once at module load. re's internal
+# pattern cache is small and shared process-wide, so hot patterns keep their
+# own handles instead of risking cache thrash on every API response
+_HTML_FENCE_OPEN_RE = re.compile(r"```html\s*")
+_HTML_FENCE_CLOSE_RE = re.compile(r"```\s*$", re.M)
+_CODE_BLOCK_RE = re.compile(r"```.*?```", re.S)
+_EXTRA_BLANK_LINES_RE = re.compile(r"\n\s*\n\s*\n")
+_H1_RE = re.compile(r"<h1[^>]*>(.*?)</h1>", re.S)
+_TAG_RE = re.compile(r"<[^>]+>")
+_WS_RE = re.compile(r"\s+")
+
+def _stream_completion(client: OpenAI, model: str, messages: List[Dict[str, str]],
+                       temperature: float, max_tokens: int,
+                       with_finish_reason: bool = False):
+    """
+    Stream a chat completion into a buffer. Tokens are consumed as they
+    arrive, so the multi-second tail of a long response overlaps with our own
+    accumulation instead of being paid after a blocking call returns. Logs
+    time-to-first-token separately from total time: TTFT tracks queueing and
+    prompt processing, the rest is pure generation throughput.
+
+    With with_finish_reason=True returns (text, finish_reason) — the final
+    stream chunk carries finish_reason just like a blocking response, so
+    callers with truncation/continuation logic lose nothing by streaming.
+    """
+    buf = io.StringIO()
+    t0 = time.monotonic()
+    ttft = None
+    finish_reason = None
+    stream = client.chat.completions.create(model=model, messages=messages,
+                                            temperature=temperature, max_tokens=max_tokens,
+                                            stream=True)
+    for chunk in stream:
+        if chunk.choices:
+            if chunk.choices[0].delta.content:
+                if ttft is None:
+                    ttft = time.monotonic() - t0
+                buf.write(chunk.choices[0].delta.content)
+            if chunk.choices[0].finish_reason is not None:
+                finish_reason = chunk.choices[0].finish_reason
+    if ttft is not None:
+        LOG.info("Stream done: TTFT %.2fs, total %.2fs, %d chars",
+                 ttft, time.monotonic() - t0, buf.tell())
+    text = buf.getvalue().strip()
+    if with_finish_reason:
+        return text, finish_reason
+    return text
+
+def _stream_json_completion(client: OpenAI, model: str, messages: List[Dict[str, str]],
+                            temperature: float, max_tokens: int) -> str:
+    """
+    Stream a JSON response and stop reading as soon as the top-level object's
+    brace depth returns to zero — any trailing prose or closing fence the
+    model appends never costs a round trip. Brace counting is a heuristic
+    (braces inside string values would fool it), so callers still validate
+    with json.loads and retry.
+    """
+    buf = io.StringIO()
+    depth = 0
+    started = False
+    stream = client.chat.completions.create(model=model, messages=messages,
+                                            temperature=temperature, max_tokens=max_tokens,
+                                            response_format={"type": "json_object"},
+                                            stream=True)
+    for chunk in stream:
+        delta = chunk.choices[0].delta.content if chunk.choices else None
+        if not delta:
+            continue
+        buf.write(delta)
+        for ch in delta:
+            if ch == "{":
+                depth += 1
+                started = True
+            elif ch == "}":
+                depth -= 1
+        if started and depth <= 0:
+            break
+    return buf.getvalue().strip()
+
+class Brief(BaseModel):
+    """Continuation brief handed from one section to the next."""
+    title: str = ""
+    last_sentence: str = ""
+    main_points: List[str] = []
+    tone: str = ""
+    suggested_next_headings: List[str] = []
 
 def summarize_section_for_continuation(client: OpenAI, text: str) -> Dict[str, Any]:
     """
     Ask the model to produce a compact JSON brief.
-    Improved prompt for strict JSON output.
+    JSON mode plus pydantic validation replaces the old regex salvage.
     """
     user_prompt = (
         "خلاصه‌ای کوتاه و ساختارمند برای ادامهٔ متن تولید کن. خروجی فقط یک JSON معتبر بده با فیلدهای زیر:\n"
@@ -283,27 +767,21 @@ def summarize_section_for_continuation(client: OpenAI, text: str) -> Dict[str, A
     last_exc = None
     for attempt in range(API_RETRY):
         try:
-            resp = client.chat.completions.create(
-                model=DEFAULT_CHAT_MODEL,
-                messages=[{"role": "system", "content": "شما یک خلاصه‌ساز هستید که فقط JSON معتبر تولید می‌کند. هیچ متن دیگری ننویس."},
-                          {"role": "user", "content": user_prompt}],
+            _rate_limiter.acquire(count_tokens(user_prompt) + SUMMARIZE_MAX_TOKENS)
+            out = _stream_json_completion(
+                client, DEFAULT_CHAT_MODEL,
+                [{"role": "system", "content": "شما یک خلاصه‌ساز هستید که فقط JSON معتبر تولید می‌کند. هیچ متن دیگری ننویس."},
+                 {"role": "user", "content": user_prompt}],
                 temperature=0.0,
                 max_tokens=SUMMARIZE_MAX_TOKENS,
             )
-            out = resp.choices[0].message.content.strip()
-            # remove code fences if present
-            out = re.sub(r"^```json\s*|\s*```$", "", out, flags=re.I)
-            # attempt to fix unterminated string by adding " at end if needed
-            if out[-1] != '}':
-                out += '" }'
-            m = re.search(r"(\{.*\})", out, flags=re.S)
-            json_text = m.group(1) if m else out
-            parsed = json.loads(json_text)
-            return parsed
+            return Brief.model_validate_json(out).model_dump()
         except Exception as e:
             last_exc = e
+            if isinstance(e, _NON_RETRYABLE_ERRORS):
+                break  # retrying can't fix it; go straight to the fallback
             LOG.warning("Summarization attempt %d failed: %s", attempt + 1, e)
-            time.sleep(API_BACKOFF_BASE * (2 ** attempt))
+            time.sleep(_retry_wait(attempt))
     LOG.warning("Summarization failed: %s. Falling back.", last_exc)
     lines = [ln.strip() for ln in text.splitlines() if ln.strip()]
     last_sentence = lines[-1] if lines else ""
@@ -327,21 +805,18 @@ def generate_structure(client: OpenAI, index: faiss.Index, meta: List[Dict[str,A
     
     retrieved = retrieve_top_k(client, index, meta, enhanced_query, top_k=RETRIEVE_TOP_K)
     
-    # Filter and prioritize relevant content based on keyword similarity
+    # Filter and prioritize relevant content based on keyword similarity.
+    # One compiled alternation over keyword + variations replaces up to 8
+    # containment checks per chunk, each of which re-lowered its needle.
+    needles = {keyword.lower()} | {v.lower() for v in keyword_variations[:3]}
+    needle_re = re.compile("|".join(map(re.escape, needles)))
     relevant_chunks = []
     for m, score in retrieved:
         text = m.get("text", "").lower()
         title = m.get("section_title", "").lower()
-        
-        # Check if content is relevant to the keyword
-        keyword_lower = keyword.lower()
-        is_relevant = (
-            keyword_lower in text or 
-            keyword_lower in title or
-            any(variation.lower() in text for variation in keyword_variations[:3]) or
-            any(variation.lower() in title for variation in keyword_variations[:3])
-        )
-        
+
+        is_relevant = bool(needle_re.search(text) or needle_re.search(title))
+
         if is_relevant or score > 0.7:  # Include high-scoring content even if not directly matching
             relevant_chunks.append((m, score))
     
@@ -395,6 +870,7 @@ def generate_structure(client: OpenAI, index: faiss.Index, meta: List[Dict[str,A
     last_exc = None
     for attempt in range(API_RETRY):
         try:
+            _rate_limiter.acquire(count_tokens(prompt) + max_tokens)
             resp = client.chat.completions.create(
                 model=model,
                 messages=[
@@ -403,14 +879,15 @@ def generate_structure(client: OpenAI, index: faiss.Index, meta: List[Dict[str,A
                 ],
                 temperature=temperature,
                 max_tokens=max_tokens,
+                response_format={"type": "json_object"},
             )
             out = resp.choices[0].message.content.strip()
-            out = re.sub(r"^```json\s*|\s*```$", "", out, flags=re.I)
             parsed = json.loads(out)
             return parsed
         except Exception as e:
             last_exc = e
-            wait = API_BACKOFF_BASE * (2 ** attempt)
+            _check_retryable(e)
+            wait = _retry_wait(attempt)
             LOG.warning("Structure gen attempt %d failed: %s - retrying in %.1fs", attempt + 1, e, wait)
             time.sleep(wait)
     raise RuntimeError(f"Failed to generate structure after retries: {last_exc}")
@@ -504,9 +981,128 @@ def build_section_prompt(keyword: str, section_title: str, section_level: int, s
     )
     return prompt
 
-def coherence_edit(client: OpenAI, combined: str, keyword: str, rules_block: str, examples_block: str,
-                   model: str = DEFAULT_CHAT_MODEL, temperature: float = DEFAULT_TEMPERATURE,
-                   max_tokens: int = DEFAULT_MAX_TOKENS) -> str:
+SECTION_CONCURRENCY = 5  # parallel in-flight section generations
+SECTION_SYSTEM_PROMPT = (
+    "شما یک نویسنده حرفه‌ای و متخصص تولید محتوای فارسی هستید. تخصص شما در ایجاد محتوای جامع، "
+    "جذاب و ترغیب‌کننده است. شما قوانین نگارشی فارسی را به طور کامل رعایت می‌کنید و از داده‌های "
+    "بازیابی‌شده برای دقت و الهام‌گیری استفاده می‌کنید."
+)
+PHASE1_SYSTEM_PROMPT = (
+    "شما یک نویسنده حرفه‌ای و متخصص تولید محتوای فارسی هستید. تخصص شما در ایجاد محتوای جامع، جذاب و "
+    "ترغیب‌کننده است. شما قوانین نگارشی فارسی را به طور کامل رعایت می‌کنید و محتوای انسانی و با کیفیت "
+    "تولید می‌کنید. شما از داده‌های بازیابی‌شده برای دقت و الهام‌گیری استفاده می‌کنید."
+)
+PHASE2_SYSTEM_PROMPT = (
+    "شما یک نویسنده حرفه‌ای و متخصص تولید محتوای فارسی هستید. تخصص شما در ایجاد محتوای جامع، متنوع و "
+    "جذاب است. شما قوانین نگارشی فارسی را به طور کامل رعایت می‌کنید و محتوای انسانی و با کیفیت تولید "
+    "می‌کنید. شما از داده‌های بازیابی‌شده برای دقت و الهام‌گیری استفاده می‌کنید."
+)
+EDIT_SYSTEM_PROMPT = (
+    "شما یک ویرایشگر حرفه‌ای و متخصص بهبود محتوای فارسی هستید. تخصص شما در بهبود کیفیت، پیوستگی، و "
+    "جذابیت مقالات فارسی است. شما قوانین نگارشی، SEO، و ساختار محتوا را به طور کامل رعایت می‌کنید و "
+    "محتوای نهایی را بهینه‌سازی می‌کنید."
+)
+
+async def _acomplete(model: str, messages: List[Dict[str, str]], temperature: float, max_tokens: int) -> str:
+    """Async chat completion with the module's standard retry/backoff."""
+    client = get_async_openai_client()
+    last_exc = None
+    for attempt in range(API_RETRY):
+        try:
+            await _rate_limiter.acquire_async(_estimate_chat_tokens(messages, max_tokens))
+            resp = await client.chat.completions.create(model=model, messages=messages,
+                                                        temperature=temperature, max_tokens=max_tokens)
+            return resp.choices[0].message.content.strip()
+        except Exception as e:
+            last_exc = e
+            _check_retryable(e)
+            wait = _retry_wait(attempt)
+            LOG.warning("Async completion attempt %d failed: %s - retrying in %.1fs", attempt + 1, e, wait)
+            await asyncio.sleep(wait)
+    raise RuntimeError(f"Failed chat completion after retries: {last_exc}")
+
+async def _generate_sections_async(keyword: str, sections: List[Dict[str, Any]],
+                                   retrieved_per_section: List[List[Tuple[Dict[str, Any], float]]],
+                                   intro_brief: Optional[Dict[str, Any]], perfect_html_reference: Optional[str],
+                                   model: str, temperature: float, max_tokens: int) -> List[str]:
+    """
+    Generate body sections concurrently. Each section only depends on the
+    intro brief (not on its neighbours), so the per-section completions can
+    overlap instead of paying one model round-trip after another.
+    """
+    semaphore = asyncio.Semaphore(SECTION_CONCURRENCY)
+
+    async def gen(section_idx: int, section: Dict[str, Any], retrieved) -> str:
+        prompt = build_section_prompt(keyword, section.get("title", ""), int(section.get("level", 2)),
+                                      section_idx, retrieved, intro_brief, perfect_html_reference,
+                                      EXAMPLES_BLOCK)
+        async with semaphore:
+            return await _acomplete(model=model,
+                                    messages=[{"role": "system", "content": SECTION_SYSTEM_PROMPT},
+                                              {"role": "user", "content": prompt}],
+                                    temperature=temperature, max_tokens=max_tokens)
+
+    return list(await asyncio.gather(*[gen(i + 1, section, retrieved)
+                                       for i, (section, retrieved) in enumerate(zip(sections, retrieved_per_section))]))
+
+def generate_blog_sectioned(client: OpenAI, index: faiss.Index, meta: List[Dict[str,Any]],
+                            keyword: str, out_path: Path, perfect_html_path: Optional[Path] = None,
+                            model: str = DEFAULT_CHAT_MODEL, temperature: float = DEFAULT_TEMPERATURE,
+                            max_tokens: int = DEFAULT_MAX_TOKENS):
+    """
+    Structure-driven pipeline: plan sections with generate_structure, write the
+    intro serially, then generate all body sections concurrently and stitch
+    them together with the usual coherence edit. Wall time scales with the
+    slowest section instead of the sum of all sections.
+    """
+    LOG.info("Generating sectioned blog for keyword=%s", keyword)
+    perfect_html_reference = None
+    if perfect_html_path and perfect_html_path.exists():
+        perfect_html_reference = perfect_html_path.read_text(encoding="utf-8", errors="ignore")
+
+    structure = generate_structure(client, index, meta, keyword, perfect_html_reference,
+                                   model=model, temperature=temperature, max_tokens=max_tokens)
+    sections = structure.get("sections", [])
+
+    # intro first: its brief feeds every body section
+    intro_retrieved = retrieve_top_k(client, index, meta, keyword, top_k=RETRIEVE_TOP_K)
+    intro_prompt = build_section_prompt(keyword, structure.get("h1_title", keyword), 1, 0,
+                                        intro_retrieved, None, perfect_html_reference, EXAMPLES_BLOCK)
+    intro_html = asyncio.run(_acomplete(model=model,
+                                        messages=[{"role": "system", "content": SECTION_SYSTEM_PROMPT},
+                                                  {"role": "user", "content": intro_prompt}],
+                                        temperature=temperature, max_tokens=max_tokens))
+    intro_brief = summarize_section_for_continuation(client, intro_html)
+
+    # one batched retrieval for all body sections, then concurrent generation
+    section_queries = [f"{keyword} {section.get('title', '')}" for section in sections]
+    retrieved_per_section = retrieve_batch(client, index, meta, section_queries, top_k=RETRIEVE_TOP_K)
+    section_htmls = asyncio.run(_generate_sections_async(keyword, sections, retrieved_per_section,
+                                                         intro_brief, perfect_html_reference,
+                                                         model, temperature, max_tokens))
+
+    combined = clean_html_content("\n".join([intro_html] + section_htmls))
+    combined = coherence_edit(client, combined, keyword, RULES_BLOCK, EXAMPLES_BLOCK, model, temperature, max_tokens)
+
+    seo_title = structure.get("seo_title") or extract_seo_title_from_content(combined, keyword)
+    full_html = f"""<!DOCTYPE html>
+<html lang="fa">
+<head>
+    <meta charset="UTF-8">
+    <title>{seo_title}</title>
+</head>
+<body dir="rtl">
+{combined}
+</body>
+</html>"""
+
+    full_html = finalize(full_html, keyword)
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    out_path.write_text(full_html, encoding="utf-8")
+    LOG.info("Sectioned blog saved to %s (%d words)", out_path, count_words(full_html))
+    return out_path
+
+def build_coherence_prompt(combined: str, keyword: str, rules_block: str, examples_block: str) -> str:
     word_count = count_words(combined)
     expand_note = f"اگر کمتر از {MIN_WORD_COUNT} کلمه است، به طور طبیعی گسترش بده." if word_count < MIN_WORD_COUNT else ""
     prompt = (
@@ -529,97 +1125,189 @@ def coherence_edit(client: OpenAI, combined: str, keyword: str, rules_block: str
         "- جذاب و ترغیب‌کننده\n\n"
         f"📄 مقاله فعلی:\n{combined}"
     )
+    return prompt
+
+def coherence_edit(client: OpenAI, combined: str, keyword: str, rules_block: str, examples_block: str,
+                   model: str = DEFAULT_CHAT_MODEL, temperature: float = DEFAULT_TEMPERATURE,
+                   max_tokens: int = DEFAULT_MAX_TOKENS) -> str:
+    prompt = build_coherence_prompt(combined, keyword, rules_block, examples_block)
     generated = None
     last_exc = None
     for attempt in range(API_RETRY):
         try:
-            resp = client.chat.completions.create(
-                model=model,
-                messages=[
-                    {"role": "system", "content": "شما یک ویرایشگر حرفه‌ای و متخصص بهبود محتوای فارسی هستید. تخصص شما در بهبود کیفیت، پیوستگی، و جذابیت مقالات فارسی است. شما قوانین نگارشی، SEO، و ساختار محتوا را به طور کامل رعایت می‌کنید و محتوای نهایی را بهینه‌سازی می‌کنید."},
-                    {"role": "user", "content": prompt}
-                ],
+            _rate_limiter.acquire(count_tokens(prompt) + max_tokens * 2)
+            generated = _stream_completion(
+                client, model,
+                [{"role": "system", "content": EDIT_SYSTEM_PROMPT},
+                 {"role": "user", "content": prompt}],
                 temperature=temperature,
                 max_tokens=max_tokens * 2,  # Allow more for edit
             )
-            generated = resp.choices[0].message.content.strip()
             break
         except Exception as e:
             last_exc = e
-            wait = API_BACKOFF_BASE * (2 ** attempt)
+            if isinstance(e, _NON_RETRYABLE_ERRORS):
+                break  # retrying can't fix it; keep the unedited draft
+            wait = _retry_wait(attempt)
             LOG.warning("Edit attempt %d failed: %s - retrying in %.1fs", attempt + 1, e, wait)
             time.sleep(wait)
     if generated is None:
         LOG.warning("Coherence edit failed: %s. Returning original.", last_exc)
         return combined
-    return normalize_persian_spacing_and_mi(generated)
+    return generated
+
+SEM_CACHE_DIR = Path("outputs")
+SEM_CACHE_THRESHOLD = 0.95  # cosine similarity for a keyword to count as "same article"
+SEM_CACHE_TTL = 7 * 24 * 3600  # seconds before a cached article goes stale
+
+class SemanticCache:
+    """
+    Semantic cache of finished generations keyed by the keyword embedding.
+    Near-duplicate keywords ("امنیت سایت وردپرسی" vs "امنیت سایت وردپرس")
+    retrieve near-identical RAG context and would regenerate an
+    interchangeable article; a cosine hit above the threshold short-circuits
+    the whole pipeline. Index persists as FAISS + JSON under outputs/.
+    """
+    def __init__(self, cache_dir: Path = SEM_CACHE_DIR,
+                 threshold: float = SEM_CACHE_THRESHOLD, ttl: float = SEM_CACHE_TTL):
+        self.index_path = cache_dir / "sem_cache.faiss"
+        self.meta_path = cache_dir / "sem_cache.json"
+        self.threshold = threshold
+        self.ttl = ttl
+        self.index: Optional[faiss.Index] = None
+        self.entries: List[Dict[str, Any]] = []
+        if self.index_path.exists() and self.meta_path.exists():
+            try:
+                self.index = faiss.read_index(str(self.index_path))
+                self.entries = json.loads(self.meta_path.read_text(encoding="utf-8"))
+            except Exception as e:
+                LOG.warning("Ignoring unreadable semantic cache: %s", e)
+                self.index = None
+                self.entries = []
+
+    def _embed(self, client: OpenAI, keyword: str) -> np.ndarray:
+        q = embed_text(client, [keyword])
+        faiss.normalize_L2(q)
+        return q
+
+    def lookup(self, client: OpenAI, keyword: str) -> Optional[Path]:
+        if self.index is None or self.index.ntotal == 0:
+            return None
+        D, I = self.index.search(self._embed(client, keyword), 1)
+        sim, idx = float(D[0][0]), int(I[0][0])
+        if idx < 0 or sim < self.threshold:
+            return None
+        entry = self.entries[idx]
+        if time.time() - entry["ts"] > self.ttl:
+            return None
+        html_path = Path(entry["html_path"])
+        if not html_path.exists():
+            return None
+        LOG.info("Semantic cache hit for '%s' (sim=%.3f, cached keyword '%s')",
+                 keyword, sim, entry.get("keyword"))
+        return html_path
+
+    def add(self, client: OpenAI, keyword: str, html_path: Path) -> None:
+        q = self._embed(client, keyword)
+        if self.index is None:
+            self.index = faiss.IndexFlatIP(q.shape[1])
+        self.index.add(q)
+        self.entries.append({"keyword": keyword, "html_path": str(html_path), "ts": time.time()})
+        self.index_path.parent.mkdir(parents=True, exist_ok=True)
+        faiss.write_index(self.index, str(self.index_path))
+        self.meta_path.write_text(json.dumps(self.entries, ensure_ascii=False, indent=2),
+                                  encoding="utf-8")
+
+_sem_cache: Optional[SemanticCache] = None
+
+def get_semantic_cache() -> SemanticCache:
+    global _sem_cache
+    if _sem_cache is None:
+        _sem_cache = SemanticCache()
+    return _sem_cache
 
 def generate_blog(client: OpenAI, index: faiss.Index, meta: List[Dict[str,Any]],
                   keyword: str, out_path: Path, perfect_html_path: Optional[Path] = None,
                   model: str = DEFAULT_CHAT_MODEL, temperature: float = DEFAULT_TEMPERATURE,
                   max_tokens: int = DEFAULT_MAX_TOKENS):
     LOG.info("Generating comprehensive blog for keyword=%s", keyword)
+
+    # near-duplicate keyword? reuse the finished article instead of paying
+    # for the whole generation pipeline again
+    sem_cache = get_semantic_cache()
+    cached = sem_cache.lookup(client, keyword)
+    if cached is not None:
+        out_path.parent.mkdir(parents=True, exist_ok=True)
+        if cached.resolve() != out_path.resolve():
+            out_path.write_text(cached.read_text(encoding="utf-8"), encoding="utf-8")
+        return out_path
+
     perfect_html_reference = None
     if perfect_html_path and perfect_html_path.exists():
         perfect_html_reference = perfect_html_path.read_text(encoding="utf-8", errors="ignore")
 
-    # Phase 1: Generate comprehensive first section with H1 and 2-3 paragraphs
-    LOG.info("Phase 1: Generating comprehensive introduction section...")
-    phase1_content, next_section_prompt = generate_phase1_content(
-        client, index, meta, keyword, perfect_html_reference, model, temperature, max_tokens
-    )
-    
+    # Phase 1: Generate comprehensive first section with H1 and 2-3 paragraphs.
+    # Phase 2's RAG retrieval is keyword-only, so it prefetches in a worker
+    # thread while the Phase 1 completion streams — the retrieval's embedding
+    # round-trip and FAISS scan cost no extra wall time.
+    LOG.info("Phase 1: Generating introduction (Phase 2 retrieval prefetching)...")
+
+    async def _phase1_with_prefetch():
+        prefetch = asyncio.create_task(asyncio.to_thread(_phase2_retrieve, client, index, meta, keyword))
+        phase1 = await asyncio.to_thread(generate_phase1_content, client, index, meta, keyword,
+                                         perfect_html_reference, model, temperature, max_tokens)
+        return phase1, await prefetch
+
+    (phase1_content, next_section_prompt), phase2_retrieved = asyncio.run(_phase1_with_prefetch())
+
     # Clean Phase 1 content
     phase1_content = clean_html_content(phase1_content)
-    
+
     # Phase 2: Generate remaining content based on Phase 1 prompt
     LOG.info("Phase 2: Generating remaining content based on Phase 1 prompt...")
     phase2_content = generate_phase2_content(
-        client, index, meta, keyword, next_section_prompt, perfect_html_reference, model, temperature, max_tokens
+        client, index, meta, keyword, next_section_prompt, perfect_html_reference, model, temperature, max_tokens,
+        retrieved=phase2_retrieved
     )
     
     # Clean Phase 2 content
     phase2_content = clean_html_content(phase2_content)
     
-    # Combine both phases
-    combined = phase1_content + "\n" + phase2_content
-    
+    # Combine both phases. Normalize before the quality gate: the typo
+    # metrics score exactly what this pass fixes, so checking raw model
+    # output would fail drafts finalize() was going to clean up anyway and
+    # re-trigger the validation round chunk2-17 skips. (finalize's own
+    # normalization pass stays — it also covers the HTML wrapper.)
+    combined = normalize_persian_spacing_and_mi(phase1_content + "\n" + phase2_content)
+
     # Phase 3: Final validation and improvement
     LOG.info("Phase 3: Final validation and improvement...")
-    
+
     # Perform advanced content quality check
     quality_metrics = advanced_content_quality_check(combined, keyword)
     LOG.info("Content quality metrics: %s", quality_metrics)
     
-    # If quality is below threshold, perform enhanced validation
+    # Only pay for the validation round when the metrics say it's needed;
+    # a passing draft skips an entire max_tokens*2 API call
     if not quality_metrics["is_high_quality"]:
-        LOG.info("Content quality below threshold, performing enhanced validation...")
-        combined = validate_and_improve_content(client, combined, keyword, model, temperature, max_tokens)
-        
+        failing = [k for k, v in quality_metrics.items()
+                   if k.endswith("_adequate") and not v]
+        LOG.info("Content quality below threshold (failing: %s), performing enhanced validation...",
+                 ", ".join(failing))
+        combined = normalize_persian_spacing_and_mi(
+            validate_and_improve_content(client, combined, keyword, model,
+                                         temperature, max_tokens, failing=failing))
+
         # Re-check quality after improvement
         quality_metrics = advanced_content_quality_check(combined, keyword)
         LOG.info("Post-improvement quality metrics: %s", quality_metrics)
     else:
-        LOG.info("Content quality is adequate, performing standard validation...")
-        combined = validate_and_improve_content(client, combined, keyword, model, temperature, max_tokens)
+        LOG.info("Content quality is adequate, skipping validation round.")
     
     # Final coherence edit
     LOG.info("Performing final coherence edit...")
     combined = coherence_edit(client, combined, keyword, RULES_BLOCK, EXAMPLES_BLOCK, model, temperature, max_tokens)
 
-    # Final content enhancement
-    if ENHANCED_CONTENT_GENERATION:
-        LOG.info("Applying final content enhancements...")
-        combined = enhance_content_with_examples(combined, keyword)
-        combined = optimize_keyword_distribution(combined, keyword)
-        combined = enhance_keyword_distribution(combined, keyword)
-        combined = add_engaging_elements(combined)
-        combined = normalize_persian_spacing_and_mi(combined)
-        
-        # Validate keyword adherence
-        if not validate_keyword_adherence(combined, keyword):
-            LOG.warning("Generated content may not sufficiently adhere to keyword: %s", keyword)
-
     word_count = count_words(combined)
     LOG.info("Final word count: %d", word_count)
     
@@ -639,17 +1327,208 @@ def generate_blog(client: OpenAI, index: faiss.Index, meta: List[Dict[str,Any]],
 </body>
 </html>"""
 
-    combined = normalize_persian_spacing_and_mi(full_html)
+    full_html = finalize(full_html, keyword)
     out_path.parent.mkdir(parents=True, exist_ok=True)
-    out_path.write_text(combined, encoding="utf-8")
-    LOG.info("Final blog saved to %s (%d words)", out_path, count_words(combined))
+    out_path.write_text(full_html, encoding="utf-8")
+    LOG.info("Final blog saved to %s (%d words)", out_path, count_words(full_html))
+    sem_cache.add(client, keyword, out_path)
     return out_path
 
-def generate_phase1_content(client: OpenAI, index: faiss.Index, meta: List[Dict[str,Any]], 
-                           keyword: str, perfect_html_reference: Optional[str], 
-                           model: str, temperature: float, max_tokens: int) -> Tuple[str, str]:
-    """Generate comprehensive first section with H1 and 2-3 paragraphs, plus prompt for next section."""
-    
+def finalize(html: str, keyword: str) -> str:
+    """
+    Single post-processing pass over the finished document. The old tail ran
+    five enhancement steps plus two extra normalization scans, each re-reading
+    the full ~100KB string; the enhancement steps were prompt-driven no-ops,
+    so what remains is one cleanup, one normalization, and the keyword
+    adherence check.
+    """
+    html = clean_html_content(html)
+    html = normalize_persian_spacing_and_mi(html)
+    if not validate_keyword_adherence(html, keyword):
+        LOG.warning("Generated content may not sufficiently adhere to keyword: %s", keyword)
+    return html
+
+BATCH_POLL_INTERVAL = 30  # seconds between batch status polls
+BATCH_COMPLETION_WINDOW = "24h"
+
+def _chat_body(model: str, system_prompt: str, user_prompt: str,
+               temperature: float, max_tokens: int) -> Dict[str, Any]:
+    return {
+        "model": model,
+        "messages": [{"role": "system", "content": system_prompt},
+                     {"role": "user", "content": user_prompt}],
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+    }
+
+def _run_chat_batch(client: OpenAI, bodies: Dict[str, Dict[str, Any]], tag: str) -> Dict[str, str]:
+    """
+    Run one round of chat completions through the Batch API: upload the
+    requests as JSONL, create the batch, poll until it settles, and map
+    custom_id -> message content. Batch runs are billed at half the
+    synchronous price and draw from a separate rate-limit pool, at the cost
+    of latency — only sensible for bulk, non-interactive jobs.
+    """
+    lines = [orjson.dumps({"custom_id": cid, "method": "POST",
+                           "url": "/v1/chat/completions", "body": body})
+             for cid, body in bodies.items()]
+    upload = client.files.create(file=(f"{tag}.jsonl", b"\n".join(lines)), purpose="batch")
+    batch = client.batches.create(input_file_id=upload.id, endpoint="/v1/chat/completions",
+                                  completion_window=BATCH_COMPLETION_WINDOW)
+    LOG.info("Batch %s submitted: %d requests, id=%s", tag, len(bodies), batch.id)
+    while batch.status not in ("completed", "failed", "expired", "cancelled"):
+        time.sleep(BATCH_POLL_INTERVAL)
+        batch = client.batches.retrieve(batch.id)
+        LOG.info("Batch %s status: %s (%s done)", tag, batch.status,
+                 getattr(batch.request_counts, "completed", "?"))
+    if batch.status != "completed":
+        raise RuntimeError(f"Batch {batch.id} ({tag}) ended with status {batch.status}")
+    raw = client.files.content(batch.output_file_id).content
+    results: Dict[str, str] = {}
+    for ln in raw.split(b"\n"):
+        if not ln.strip():
+            continue
+        rec = orjson.loads(ln)
+        resp = rec.get("response") or {}
+        if resp.get("status_code") != 200:
+            LOG.warning("Batch item %s failed: %s", rec.get("custom_id"), rec.get("error"))
+            continue
+        results[rec["custom_id"]] = resp["body"]["choices"][0]["message"]["content"].strip()
+    return results
+
+def batch_generate_blogs(client: OpenAI, index: faiss.Index, meta: List[Dict[str,Any]],
+                         keywords: List[str], out_dir: Path, perfect_html_path: Optional[Path] = None,
+                         model: str = DEFAULT_CHAT_MODEL, temperature: float = DEFAULT_TEMPERATURE,
+                         max_tokens: int = DEFAULT_MAX_TOKENS) -> List[Path]:
+    """
+    Generate one blog per keyword through the Batch API, iterating the phased
+    pipeline as successive batches: all Phase 1 prompts in one batch, then all
+    Phase 2 continuations, then all coherence edits. Meant for nightly bulk
+    runs over keyword lists where 50% cost and throughput beat latency.
+    """
+    LOG.info("Batch-generating %d blogs", len(keywords))
+    perfect_html_reference = None
+    if perfect_html_path and perfect_html_path.exists():
+        perfect_html_reference = perfect_html_path.read_text(encoding="utf-8", errors="ignore")
+
+    # Round 1: introductions
+    phase1_out = _run_chat_batch(client, {
+        f"p1_{i}": _chat_body(model, PHASE1_SYSTEM_PROMPT,
+                              build_phase1_prompt(client, index, meta, kw, perfect_html_reference),
+                              temperature, max_tokens * 2)
+        for i, kw in enumerate(keywords)
+    }, "phase1")
+
+    phase1_by_kw: Dict[int, str] = {}
+    next_prompts: Dict[int, str] = {}
+    for i, kw in enumerate(keywords):
+        content = phase1_out.get(f"p1_{i}")
+        if content is None:
+            LOG.warning("No Phase 1 output for keyword '%s'; skipping it", kw)
+            continue
+        next_prompts[i] = extract_next_section_prompt(content)
+        phase1_by_kw[i] = clean_html_content(content)
+
+    # Round 2: continuations
+    phase2_out = _run_chat_batch(client, {
+        f"p2_{i}": _chat_body(model, PHASE2_SYSTEM_PROMPT,
+                              build_phase2_prompt(client, index, meta, keywords[i], next_prompts[i],
+                                                  perfect_html_reference),
+                              temperature, max_tokens * 3)
+        for i in phase1_by_kw
+    }, "phase2")
+
+    combined_by_kw: Dict[int, str] = {}
+    for i in phase1_by_kw:
+        content = phase2_out.get(f"p2_{i}")
+        if content is None:
+            LOG.warning("No Phase 2 output for keyword '%s'; skipping it", keywords[i])
+            continue
+        phase2_content = clean_html_content(content)
+        combined_by_kw[i] = phase1_by_kw[i] + "\n" + phase2_content
+
+    # Round 3: validation/improvement (same review pass the synchronous
+    # pipeline runs via validate_and_improve_content)
+    validate_out = _run_chat_batch(client, {
+        f"val_{i}": _chat_body(model, VALIDATE_SYSTEM_PROMPT,
+                               build_validation_prompt(combined, keywords[i]),
+                               temperature, max_tokens * 2)
+        for i, combined in combined_by_kw.items()
+    }, "validate")
+    for i in combined_by_kw:
+        improved = validate_out.get(f"val_{i}")
+        if improved:
+            combined_by_kw[i] = clean_html_content(improved)
+
+    # Round 4: coherence edits
+    edit_out = _run_chat_batch(client, {
+        f"edit_{i}": _chat_body(model, EDIT_SYSTEM_PROMPT,
+                                build_coherence_prompt(combined, keywords[i], RULES_BLOCK, EXAMPLES_BLOCK),
+                                temperature, max_tokens * 2)
+        for i, combined in combined_by_kw.items()
+    }, "edit")
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    written: List[Path] = []
+    for i, combined in combined_by_kw.items():
+        keyword = keywords[i]
+        edited = edit_out.get(f"edit_{i}")
+        combined = edited if edited else combined
+        seo_title = extract_seo_title_from_content(combined, keyword)
+        full_html = f"""<!DOCTYPE html>
+<html lang="fa">
+<head>
+    <meta charset="UTF-8">
+    <title>{seo_title}</title>
+</head>
+<body dir="rtl">
+{combined}
+</body>
+</html>"""
+        out_path = out_dir / (_WS_RE.sub("_", keyword.strip()) + ".html")
+        out_path.write_text(finalize(full_html, keyword), encoding="utf-8")
+        LOG.info("Batch blog saved to %s (%d words)", out_path, count_words(full_html))
+        written.append(out_path)
+    return written
+
+def _build_context_block(selected_chunks: List[Tuple[Dict[str, Any], float]]) -> str:
+    """
+    Format selected chunks into the prompt context block, under a hard
+    character budget. Context is the dominant prompt-token cost and selection
+    is already score-ordered, so the chunks dropped past the budget are the
+    least valuable ones.
+    """
+    context_parts = []
+    used = 0
+    for m, score in selected_chunks:
+        src = m.get("source_file", "")
+        txt = m.get("text", "")
+        piece_len = len(src) + len(txt) + 40
+        if used + piece_len > CONTEXT_CHAR_BUDGET:
+            LOG.info("Context budget reached after %d of %d chunks",
+                     len(context_parts), len(selected_chunks))
+            break
+        context_parts.append("--- منبع: [{}] (chunk {}, score={:.4f})\n{}".format(
+            src, m.get("chunk_index", 0), score, txt))
+        used += piece_len
+    return "\n\n".join(context_parts)
+
+@functools.lru_cache(maxsize=4)
+def _perfect_ref_block(perfect_html_reference: Optional[str]) -> str:
+    """
+    Reference-HTML prompt block, sliced once per reference instead of once
+    per phase. Identical wording across phases keeps the shared prompt
+    prefix stable for server-side prefix caching.
+    """
+    if not perfect_html_reference:
+        return ""
+    return ("الگوی مرجع (برای ساختار/جداسازی پاراگراف‌ها/استایل‌ها/وجود جدول و CTA):\n"
+            + perfect_html_reference[:4000] + "\n")
+
+def build_phase1_prompt(client: OpenAI, index: faiss.Index, meta: List[Dict[str,Any]],
+                        keyword: str, perfect_html_reference: Optional[str]) -> str:
+    """Retrieve context and build the Phase 1 prompt for a keyword."""
+
     # Get comprehensive RAG content for the keyword
     keyword_variations = generate_keyword_variations(keyword)
     enhanced_query = f"{keyword} {' '.join(keyword_variations[:5])}"  # Use more variations
@@ -659,34 +1538,19 @@ def generate_phase1_content(client: OpenAI, index: faiss.Index, meta: List[Dict[
     
     # Use advanced RAG content selection
     selected_chunks = advanced_rag_content_selection(retrieved, keyword, "", 20)
+    context_block = _build_context_block(selected_chunks)
     
-    # Build comprehensive context
-    context_parts = []
-    for m, score in selected_chunks:
-        src = m.get("source_file", "")
-        ci = m.get("chunk_index", 0)
-        txt = m.get("text", "")
-        context_parts.append(f"--- منبع: [{src}] (chunk {ci}, score={score:.4f})\n{txt}")
-    context_block = "\n\n".join(context_parts) if context_parts else ""
-    
-    perfect_ref_block = ""
-    if perfect_html_reference:
-        perfect_ref_block = (
-            "الگوی مرجع (برای ساختار/جداسازی پاراگراف‌ها/استایل‌ها/وجود جدول و CTA):\n"
-            + perfect_html_reference[:4000] + "\n\n"
-        )
-    
-    # Create comprehensive Phase 1 prompt
+    # Create comprehensive Phase 1 prompt. The reference block sits right
+    # after the static rules/examples so Phase 1 and Phase 2 share a stable
+    # prompt prefix that OpenAI's automatic prefix caching can reuse.
     phase1_prompt = f"""
 {RULES_BLOCK}
 {EXAMPLES_BLOCK}
-
+{_perfect_ref_block(perfect_html_reference)}
 🎯 کلمه کلیدی اصلی: {keyword}
 📚 داده‌های جامع بازیابی‌شده (از این منابع برای الهام‌گیری و استناد استفاده کن):
 {context_block}
 
-{perfect_ref_block}
-
 🔍 وظیفه Phase 1: تولید بخش مقدمه جامع و کامل
 
 📌 خروجی مورد نیاز:
@@ -722,24 +1586,36 @@ NEXT_SECTION_PROMPT: [2-3 خط توضیح برای بخش بعدی]
 </div>
 """
 
+    LOG.info("Phase 1 prompt ~%d tokens (%d static)",
+             RULES_BLOCK_TOKENS + EXAMPLES_BLOCK_TOKENS + count_tokens(context_block),
+             RULES_BLOCK_TOKENS + EXAMPLES_BLOCK_TOKENS)
+
+    return phase1_prompt
+
+def generate_phase1_content(client: OpenAI, index: faiss.Index, meta: List[Dict[str,Any]],
+                           keyword: str, perfect_html_reference: Optional[str],
+                           model: str, temperature: float, max_tokens: int) -> Tuple[str, str]:
+    """Generate comprehensive first section with H1 and 2-3 paragraphs, plus prompt for next section."""
+
+    phase1_prompt = build_phase1_prompt(client, index, meta, keyword, perfect_html_reference)
+
     generated = None
     last_exc = None
     for attempt in range(API_RETRY):
         try:
-            resp = client.chat.completions.create(
-                model=model,
-                messages=[
-                    {"role": "system", "content": "شما یک نویسنده حرفه‌ای و متخصص تولید محتوای فارسی هستید. تخصص شما در ایجاد محتوای جامع، جذاب و ترغیب‌کننده است. شما قوانین نگارشی فارسی را به طور کامل رعایت می‌کنید و محتوای انسانی و با کیفیت تولید می‌کنید. شما از داده‌های بازیابی‌شده برای دقت و الهام‌گیری استفاده می‌کنید."},
-                    {"role": "user", "content": phase1_prompt}
-                ],
+            _rate_limiter.acquire(count_tokens(phase1_prompt) + max_tokens * 2)
+            generated = _stream_completion(
+                client, model,
+                [{"role": "system", "content": PHASE1_SYSTEM_PROMPT},
+                 {"role": "user", "content": phase1_prompt}],
                 temperature=temperature,
                 max_tokens=max_tokens * 2,  # Allow more tokens for comprehensive content
             )
-            generated = resp.choices[0].message.content.strip()
             break
         except Exception as e:
             last_exc = e
-            wait = API_BACKOFF_BASE * (2 ** attempt)
+            _check_retryable(e)
+            wait = _retry_wait(attempt)
             LOG.warning("Phase 1 attempt %d failed: %s - retrying in %.1fs", attempt + 1, e, wait)
             time.sleep(wait)
     
@@ -748,56 +1624,59 @@ NEXT_SECTION_PROMPT: [2-3 خط توضیح برای بخش بعدی]
 
     # Extract next section prompt
     next_section_prompt = extract_next_section_prompt(generated)
-    
-    # Clean the content
-    generated = normalize_persian_spacing_and_mi(generated)
-    
+
     LOG.info("Phase 1 generated (%d chars)", len(generated))
     return generated, next_section_prompt
 
-def generate_phase2_content(client: OpenAI, index: faiss.Index, meta: List[Dict[str,Any]], 
-                           keyword: str, next_section_prompt: str, perfect_html_reference: Optional[str], 
-                           model: str, temperature: float, max_tokens: int) -> str:
-    """Generate remaining content based on Phase 1 prompt."""
-    
-    # Get diverse RAG content for remaining sections
+def _phase2_retrieve(client: OpenAI, index: faiss.Index, meta: List[Dict[str,Any]],
+                     keyword: str) -> List[Tuple[Dict[str,Any], float]]:
+    """
+    Phase 2 candidate retrieval. Depends only on the keyword — not on the
+    Phase 1 output — so callers can run it while Phase 1 streams.
+
+    The keyword and its top variations go through retrieve_batch as separate
+    query rows: one embedding call and one batched FAISS search (which
+    parallelizes rows across OpenMP threads) instead of one blended query
+    whose averaged embedding can drown out the rarer variations. Rows are
+    merged by chunk id, keeping each chunk's best score.
+    """
     keyword_variations = generate_keyword_variations(keyword)
-    enhanced_query = f"{keyword} {' '.join(keyword_variations[:5])}"
-    
-    # Retrieve diverse content for remaining sections
-    retrieved = retrieve_top_k(client, index, meta, enhanced_query, top_k=RETRIEVE_TOP_K * 2)
-    
+    queries = list(dict.fromkeys([keyword, *keyword_variations[:5]]))
+    rows = retrieve_batch(client, index, meta, queries, top_k=RETRIEVE_TOP_K * 2)
+    best: Dict[Any, Tuple[Dict[str, Any], float]] = {}
+    for row in rows:
+        for m, score in row:
+            key = m.get("id")
+            prev = best.get(key)
+            if prev is None or score > prev[1]:
+                best[key] = (m, score)
+    merged = sorted(best.values(), key=lambda t: t[1], reverse=True)
+    return merged[:RETRIEVE_TOP_K * 2]
+
+def build_phase2_prompt(client: OpenAI, index: faiss.Index, meta: List[Dict[str,Any]],
+                        keyword: str, next_section_prompt: str, perfect_html_reference: Optional[str],
+                        retrieved: Optional[List[Tuple[Dict[str,Any], float]]] = None) -> str:
+    """Retrieve context and build the Phase 2 prompt continuing from the Phase 1 handoff."""
+
+    # Retrieve diverse content for remaining sections (unless prefetched)
+    if retrieved is None:
+        retrieved = _phase2_retrieve(client, index, meta, keyword)
+
     # Use advanced RAG content selection for Phase 2
     selected_chunks = advanced_rag_content_selection(retrieved, keyword, next_section_prompt, 25)
+    context_block = _build_context_block(selected_chunks)
     
-    # Build comprehensive context
-    context_parts = []
-    for m, score in selected_chunks:
-        src = m.get("source_file", "")
-        ci = m.get("chunk_index", 0)
-        txt = m.get("text", "")
-        context_parts.append(f"--- منبع: [{src}] (chunk {ci}, score={score:.4f})\n{txt}")
-    context_block = "\n\n".join(context_parts) if context_parts else ""
-    
-    perfect_ref_block = ""
-    if perfect_html_reference:
-        perfect_ref_block = (
-            "الگوی مرجع:\n"
-            + perfect_html_reference[:4000] + "\n\n"
-        )
-    
-    # Create comprehensive Phase 2 prompt
+    # Create comprehensive Phase 2 prompt, opening with the same static
+    # rules/examples/reference prefix as Phase 1 for prefix-cache reuse
     phase2_prompt = f"""
 {RULES_BLOCK}
 {EXAMPLES_BLOCK}
-
+{_perfect_ref_block(perfect_html_reference)}
 🎯 کلمه کلیدی اصلی: {keyword}
 📝 راهنمای بخش بعدی از Phase 1: {next_section_prompt}
 📚 داده‌های جامع بازیابی‌شده (از این منابع برای الهام‌گیری و استناد استفاده کن):
 {context_block}
 
-{perfect_ref_block}
-
 🔍 وظیفه Phase 2: تولید محتوای جامع و کامل برای ادامه مقاله
 
 📌 خروجی مورد نیاز:
@@ -842,73 +1721,100 @@ def generate_phase2_content(client: OpenAI, index: faiss.Index, meta: List[Dict[
 
 <p><strong>منابع:</strong> [source_files]</p>
 """
-    
+
+    return phase2_prompt
+
+def generate_phase2_content(client: OpenAI, index: faiss.Index, meta: List[Dict[str,Any]],
+                           keyword: str, next_section_prompt: str, perfect_html_reference: Optional[str],
+                           model: str, temperature: float, max_tokens: int,
+                           retrieved: Optional[List[Tuple[Dict[str,Any], float]]] = None) -> str:
+    """Generate remaining content based on Phase 1 prompt."""
+
+    phase2_prompt = build_phase2_prompt(client, index, meta, keyword, next_section_prompt,
+                                        perfect_html_reference, retrieved=retrieved)
+
+    # Explicit budget sized from the word target instead of max_tokens*3:
+    # smaller reservations schedule faster server-side, and the rare
+    # truncation is finished with a cheap continuation call below
     generated = None
     last_exc = None
     for attempt in range(API_RETRY):
         try:
-            resp = client.chat.completions.create(
-                model=model,
-                messages=[
-                    {"role": "system", "content": "شما یک نویسنده حرفه‌ای و متخصص تولید محتوای فارسی هستید. تخصص شما در ایجاد محتوای جامع، متنوع و جذاب است. شما قوانین نگارشی فارسی را به طور کامل رعایت می‌کنید و محتوای انسانی و با کیفیت تولید می‌کنید. شما از داده‌های بازیابی‌شده برای دقت و الهام‌گیری استفاده می‌کنید."},
-                    {"role": "user", "content": phase2_prompt}
-                ],
+            _rate_limiter.acquire(count_tokens(phase2_prompt) + PHASE2_TOKEN_BUDGET)
+            generated, finish_reason = _stream_completion(
+                client, model,
+                [{"role": "system", "content": PHASE2_SYSTEM_PROMPT},
+                 {"role": "user", "content": phase2_prompt}],
                 temperature=temperature,
-                max_tokens=max_tokens * 3,  # Allow more tokens for comprehensive content
+                max_tokens=PHASE2_TOKEN_BUDGET,
+                with_finish_reason=True,
             )
-            generated = resp.choices[0].message.content.strip()
+            if finish_reason == "length":
+                LOG.info("Phase 2 hit the token budget; requesting continuation")
+                cont_prompt = ("خروجی قطع شد. دقیقا از همین نقطه ادامه بده و تکرار نکن. "
+                               "آخرین بخش تولیدشده:\n" + generated[-200:])
+                _rate_limiter.acquire(count_tokens(phase2_prompt) + PHASE2_TOKEN_BUDGET)
+                generated += _stream_completion(
+                    client, model,
+                    [{"role": "system", "content": PHASE2_SYSTEM_PROMPT},
+                     {"role": "user", "content": phase2_prompt},
+                     {"role": "assistant", "content": generated},
+                     {"role": "user", "content": cont_prompt}],
+                    temperature=temperature,
+                    max_tokens=PHASE2_TOKEN_BUDGET,
+                )
             break
         except Exception as e:
             last_exc = e
-            wait = API_BACKOFF_BASE * (2 ** attempt)
+            _check_retryable(e)
+            wait = _retry_wait(attempt)
             LOG.warning("Phase 2 attempt %d failed: %s - retrying in %.1fs", attempt + 1, e, wait)
             time.sleep(wait)
     
     if generated is None:
         raise RuntimeError(f"Failed to generate Phase 2 content: {last_exc}")
-    
-    # Clean the content
-    generated = normalize_persian_spacing_and_mi(generated)
-    
+
     LOG.info("Phase 2 generated (%d chars)", len(generated))
     return generated
 
+_NEXT_SECTION_MARKER = "NEXT_SECTION_PROMPT:"
+
 def extract_next_section_prompt(content: str) -> str:
     """Extract next section prompt from Phase 1 content."""
-    import re
-    
-    # Look for NEXT_SECTION_PROMPT in the content
-    pattern = r'NEXT_SECTION_PROMPT:\s*(.+?)(?=\n|$)'
-    match = re.search(pattern, content, re.DOTALL)
-    
-    if match:
-        return match.group(1).strip()
-    
+    # plain str.find for a literal marker: same semantics as the old regex
+    # (skip whitespace after the colon, take up to the next newline) without
+    # engaging the regex engine on a multi-KB document
+    idx = content.find(_NEXT_SECTION_MARKER)
+    if idx >= 0:
+        rest = content[idx + len(_NEXT_SECTION_MARKER):].lstrip()
+        end = rest.find("\n")
+        line = (rest if end < 0 else rest[:end]).strip()
+        if line:
+            return line
+
     # Fallback: generate a generic prompt
     return "ادامه موضوع با جزئیات بیشتر، مثال‌های عملی و راهکارهای کاربردی"
 
 def clean_html_content(content: str) -> str:
     """Clean HTML content by removing code blocks and fixing formatting."""
-    import re
-    
     # Remove HTML code blocks
-    content = re.sub(r'```html\s*', '', content)
-    content = re.sub(r'```\s*$', '', content, flags=re.MULTILINE)
-    
+    content = _HTML_FENCE_OPEN_RE.sub('', content)
+    content = _HTML_FENCE_CLOSE_RE.sub('', content)
+
     # Remove any remaining code block markers
-    content = re.sub(r'```.*?```', '', content, flags=re.DOTALL)
-    
+    content = _CODE_BLOCK_RE.sub('', content)
+
     # Clean up extra whitespace
-    content = re.sub(r'\n\s*\n\s*\n', '\n\n', content)
-    
+    content = _EXTRA_BLANK_LINES_RE.sub('\n\n', content)
+
     return content.strip()
 
-def validate_and_improve_content(client: OpenAI, content: str, keyword: str, 
-                                model: str, temperature: float, max_tokens: int) -> str:
-    """Final validation and improvement phase for the complete blog."""
-    
+def build_validation_prompt(content: str, keyword: str,
+                            failing: Optional[List[str]] = None) -> str:
+    """Build the final review/improvement prompt for the complete blog."""
+
     word_count = count_words(content)
-    
+
     validation_prompt = f"""
 {RULES_BLOCK}
 {EXAMPLES_BLOCK}
@@ -984,15 +1890,37 @@ def validate_and_improve_content(client: OpenAI, content: str, keyword: str,
 
 فقط HTML خالص تولید کنید (بدون کد بلاک).
 """
-    
+
+    if failing:
+        # steer the model at the checks that actually failed so it doesn't
+        # rewrite passing sections
+        validation_prompt += (
+            "\n🔴 تمرکز اصلی ویرایش — این بررسی‌ها ناموفق بوده‌اند و باید اصلاح شوند: "
+            + "، ".join(failing) + "\n"
+        )
+
+    return validation_prompt
+
+VALIDATE_SYSTEM_PROMPT = (
+    "شما یک ویرایشگر حرفه‌ای و متخصص بهبود محتوای فارسی هستید. شما مانند یک انسان متخصص که قوانین نگارشی فارسی را به طور کامل می‌داند، عمل می‌کنید. تخصص شما در بررسی، بهبود و تکمیل محتوای فارسی است. شما باید محتوا را به گونه‌ای ویرایش کنید که گویی یک انسان متخصص آن را نوشته است. شما قوانین نگارشی فارسی را به طور کامل رعایت می‌کنید، لحن انسانی و دوستانه ایجاد می‌کنید، و محتوای با کیفیت و کامل تولید می‌کنید. شما باید هر بخش از محتوا را بررسی کنید و اگر لحن مناسب نیست، آن را انسانی‌تر و دوستانه‌تر کنید."
+)
+
+def validate_and_improve_content(client: OpenAI, content: str, keyword: str,
+                                model: str, temperature: float, max_tokens: int,
+                                failing: Optional[List[str]] = None) -> str:
+    """Final validation and improvement phase for the complete blog."""
+
+    validation_prompt = build_validation_prompt(content, keyword, failing=failing)
+
     generated = None
     last_exc = None
     for attempt in range(API_RETRY):
         try:
+            _rate_limiter.acquire(count_tokens(validation_prompt) + max_tokens * 2)
             resp = client.chat.completions.create(
                 model=model,
                 messages=[
-                    {"role": "system", "content": "شما یک ویرایشگر حرفه‌ای و متخصص بهبود محتوای فارسی هستید. شما مانند یک انسان متخصص که قوانین نگارشی فارسی را به طور کامل می‌داند، عمل می‌کنید. تخصص شما در بررسی، بهبود و تکمیل محتوای فارسی است. شما باید محتوا را به گونه‌ای ویرایش کنید که گویی یک انسان متخصص آن را نوشته است. شما قوانین نگارشی فارسی را به طور کامل رعایت می‌کنید، لحن انسانی و دوستانه ایجاد می‌کنید، و محتوای با کیفیت و کامل تولید می‌کنید. شما باید هر بخش از محتوا را بررسی کنید و اگر لحن مناسب نیست، آن را انسانی‌تر و دوستانه‌تر کنید."},
+                    {"role": "system", "content": VALIDATE_SYSTEM_PROMPT},
                     {"role": "user", "content": validation_prompt}
                 ],
                 temperature=temperature,
@@ -1002,7 +1930,9 @@ def validate_and_improve_content(client: OpenAI, content: str, keyword: str,
             break
         except Exception as e:
             last_exc = e
-            wait = API_BACKOFF_BASE * (2 ** attempt)
+            if isinstance(e, _NON_RETRYABLE_ERRORS):
+                break  # retrying can't fix it; return the original content
+            wait = _retry_wait(attempt)
             LOG.warning("Validation attempt %d failed: %s - retrying in %.1fs", attempt + 1, e, wait)
             time.sleep(wait)
     
@@ -1019,174 +1949,120 @@ def validate_and_improve_content(client: OpenAI, content: str, keyword: str,
 
 def extract_seo_title_from_content(content: str, keyword: str) -> str:
     """Extract SEO title from H1 content."""
-    import re
-    
-    # Look for H1 tag
-    h1_pattern = r'<h1[^>]*>(.*?)</h1>'
-    match = re.search(h1_pattern, content, re.DOTALL)
-    
+    match = _H1_RE.search(content)
+
     if match:
         h1_title = match.group(1).strip()
         # Clean HTML tags
-        h1_title = re.sub(r'<[^>]+>', '', h1_title)
+        h1_title = _TAG_RE.sub('', h1_title)
         return h1_title
     
     # Fallback: use keyword
     return f"{keyword} - راهنمای کامل"
 
-def advanced_rag_content_selection(retrieved: List[Tuple[Dict[str, Any], float]], 
-                                  keyword: str, section_title: str = "", 
+def advanced_rag_content_selection(retrieved: List[Tuple[Dict[str, Any], float]],
+                                  keyword: str, section_title: str = "",
                                   max_chunks: int = 20) -> List[Tuple[Dict[str, Any], float]]:
     """Advanced RAG content selection with diversity and relevance optimization."""
-    
+
     if not retrieved:
         return []
-    
-    # Generate keyword variations for better matching
+
+    n = len(retrieved)
     keyword_variations = generate_keyword_variations(keyword)
     keyword_lower = keyword.lower()
     section_lower = section_title.lower()
-    
-    # Score each chunk based on relevance and diversity
-    scored_chunks = []
-    used_sources = set()
-    used_titles = set()
-    
-    for m, score in retrieved:
-        text = m.get("text", "").lower()
-        title = m.get("section_title", "").lower()
-        source = m.get("source_file", "")
-        
-        # Calculate relevance score
-        relevance_score = 0.0
-        
-        # Direct keyword match
-        if keyword_lower in text:
-            relevance_score += 0.4
-        if keyword_lower in title:
-            relevance_score += 0.3
-            
-        # Section title match
-        if section_lower and section_lower in text:
-            relevance_score += 0.2
-        if section_lower and section_lower in title:
-            relevance_score += 0.15
-            
-        # Keyword variations match
-        for variation in keyword_variations[:5]:
-            if variation.lower() in text:
-                relevance_score += 0.1
-            if variation.lower() in title:
-                relevance_score += 0.05
-        
-        # Original FAISS score
-        relevance_score += score * 0.2
-        
-        # Calculate diversity score
-        diversity_score = 0.0
-        if source not in used_sources:
-            diversity_score += 0.3
-        if title not in used_titles:
-            diversity_score += 0.2
-        
-        # Combined score
-        combined_score = (RELEVANCE_WEIGHT * relevance_score + 
-                         DIVERSITY_WEIGHT * diversity_score)
-        
-        scored_chunks.append((m, combined_score, relevance_score, diversity_score))
-    
-    # Sort by combined score
-    scored_chunks.sort(key=lambda x: x[1], reverse=True)
-    
+    variations_lower = [v.lower() for v in keyword_variations[:5]]
+
+    # lowercase each chunk once and memoize it on the chunk dict itself:
+    # the same meta dicts are re-selected across phases and keywords, so a
+    # multi-KB text only ever pays for .lower() once per process
+    texts_lower = []
+    titles_lower = []
+    for m, _ in retrieved:
+        text_lower = m.get("_text_lower")
+        if text_lower is None:
+            text_lower = m["_text_lower"] = m.get("text", "").lower()
+        texts_lower.append(text_lower)
+        title_lower = m.get("_title_lower")
+        if title_lower is None:
+            title_lower = m["_title_lower"] = m.get("section_title", "").lower()
+        titles_lower.append(title_lower)
+    sources = [m.get("source_file", "") for m, _ in retrieved]
+
+    def contains(needle: str, haystacks: List[str]) -> np.ndarray:
+        return np.fromiter((needle in h for h in haystacks), dtype=np.float64, count=n)
+
+    relevance = 0.4 * contains(keyword_lower, texts_lower) + 0.3 * contains(keyword_lower, titles_lower)
+    if section_lower:
+        relevance += 0.2 * contains(section_lower, texts_lower) + 0.15 * contains(section_lower, titles_lower)
+    for variation in variations_lower:
+        relevance += 0.1 * contains(variation, texts_lower) + 0.05 * contains(variation, titles_lower)
+    relevance += 0.2 * np.fromiter((score for _, score in retrieved), dtype=np.float64, count=n)
+
+    # the scoring-phase diversity term was a constant (its seen-sets were
+    # never updated while scoring), so it shifts every combined score equally
+    combined = RELEVANCE_WEIGHT * relevance + DIVERSITY_WEIGHT * 0.5
+    order = np.argsort(-combined, kind="stable")
+
     # Select diverse and relevant chunks
-    selected_chunks = []
+    selected_chunks: List[Tuple[Dict[str, Any], float]] = []
+    selected_idx = set()
     used_sources = set()
-    used_titles = set()
-    
-    for m, combined_score, relevance_score, diversity_score in scored_chunks:
-        source = m.get("source_file", "")
-        title = m.get("section_title", "")
-        
-        # Prioritize high-relevance chunks
-        if relevance_score > 0.5 or len(selected_chunks) < 5:
-            selected_chunks.append((m, combined_score))
-            used_sources.add(source)
-            used_titles.add(title)
-        # Add diverse chunks if we have space
-        elif (diversity_score > 0.3 and 
-              source not in used_sources and 
-              len(selected_chunks) < max_chunks):
-            selected_chunks.append((m, combined_score))
-            used_sources.add(source)
-            used_titles.add(title)
-        
+    for j in order:
+        j = int(j)
+        # Prioritize high-relevance chunks; fill remaining space with
+        # not-yet-seen sources
+        if relevance[j] > 0.5 or len(selected_chunks) < 5:
+            pass
+        elif sources[j] in used_sources or len(selected_chunks) >= max_chunks:
+            continue
+        selected_chunks.append((retrieved[j][0], float(combined[j])))
+        selected_idx.add(j)
+        used_sources.add(sources[j])
         if len(selected_chunks) >= max_chunks:
             break
-    
+
     # If we don't have enough chunks, add the best remaining ones
     if len(selected_chunks) < 5:
-        for m, combined_score, relevance_score, diversity_score in scored_chunks:
-            if (m, combined_score) not in selected_chunks:
-                selected_chunks.append((m, combined_score))
-                if len(selected_chunks) >= 10:
-                    break
-    
+        for j in order:
+            j = int(j)
+            if j in selected_idx:
+                continue
+            selected_chunks.append((retrieved[j][0], float(combined[j])))
+            if len(selected_chunks) >= 10:
+                break
+
     return selected_chunks
 
-def generate_keyword_variations(keyword: str) -> List[str]:
+# Variation rules as one table: (triggers, substitutions, extra variations).
+# A rule fires when any trigger appears in the lowercased keyword; its
+# substitutions are applied to the keyword and its extras appended verbatim.
+# Data instead of an if-chain, so adding a rule is one line, not a branch.
+_VARIATION_RULES: Tuple[Tuple[Tuple[str, ...], Tuple[Tuple[str, str], ...], Tuple[str, ...]], ...] = (
+    (("طراحی",), (("طراحی", "ساخت"), ("طراحی", "ایجاد")), ()),
+    (("سایت",), (("سایت", "وب‌سایت"), ("سایت", "پورتال")), ()),
+    (("پزشکی",), (("پزشکی", "درمانی"), ("پزشکی", "کلینیکی")), ()),
+    (("طراحی سایت",), (), ("سئو سایت", "بهینه‌سازی سایت", "راه‌اندازی سایت", "توسعه وب")),
+    (("سئو",), (), ("بهینه‌سازی موتور جست‌وجو", "رتبه‌بندی گوگل", "بازاریابی دیجیتال")),
+    (("وردپرس", "wordpress"), (), ("وردپرس", "WordPress", "سیستم مدیریت محتوا", "CMS")),
+    (("امنیت", "security"), (), ("امنیت", "Security", "حفاظت", "محافظت", "ایمنی")),
+    (("امنیت سایت",), (), ("امنیت وب‌سایت", "حفاظت سایت", "امنیت آنلاین", "امنیت دیجیتال")),
+    (("امنیت سایت وردپرسی",), (), ("امنیت وردپرس", "حفاظت وردپرس", "امنیت سایت وردپرس",
+                                   "WordPress Security", "امنیت CMS", "حفاظت وب‌سایت وردپرس")),
+)
+
+@functools.lru_cache(maxsize=256)
+def generate_keyword_variations(keyword: str) -> Tuple[str, ...]:
     """Generate related keywords and variations for better content diversity."""
     variations = [keyword]
-    
-    # Add common Persian variations
-    if "طراحی" in keyword:
-        variations.extend([keyword.replace("طراحی", "ساخت"), keyword.replace("طراحی", "ایجاد")])
-    if "سایت" in keyword:
-        variations.extend([keyword.replace("سایت", "وب‌سایت"), keyword.replace("سایت", "پورتال")])
-    if "پزشکی" in keyword:
-        variations.extend([keyword.replace("پزشکی", "درمانی"), keyword.replace("پزشکی", "کلینیکی")])
-    
-    # Add LSI keywords
-    if "طراحی سایت" in keyword:
-        variations.extend(["سئو سایت", "بهینه‌سازی سایت", "راه‌اندازی سایت", "توسعه وب"])
-    if "سئو" in keyword:
-        variations.extend(["بهینه‌سازی موتور جست‌وجو", "رتبه‌بندی گوگل", "بازاریابی دیجیتال"])
-    
-    # Add WordPress and security specific variations
-    if "وردپرس" in keyword or "wordpress" in keyword.lower():
-        variations.extend(["وردپرس", "WordPress", "سیستم مدیریت محتوا", "CMS"])
-    if "امنیت" in keyword or "security" in keyword.lower():
-        variations.extend(["امنیت", "Security", "حفاظت", "محافظت", "ایمنی"])
-    if "امنیت سایت" in keyword:
-        variations.extend(["امنیت وب‌سایت", "حفاظت سایت", "امنیت آنلاین", "امنیت دیجیتال"])
-    if "امنیت سایت وردپرسی" in keyword:
-        variations.extend([
-            "امنیت وردپرس", "حفاظت وردپرس", "امنیت سایت وردپرس", 
-            "WordPress Security", "امنیت CMS", "حفاظت وب‌سایت وردپرس"
-        ])
-    
-    return list(set(variations))  # Remove duplicates
-
-def enhance_content_with_examples(text: str, keyword: str) -> str:
-    """Enhance content with relevant examples and statistics."""
-    # This function can be expanded to add more sophisticated content enhancement
-    # For now, we'll rely on the AI model to generate examples based on our prompts
-    return text
-
-def optimize_keyword_distribution(text: str, keyword: str) -> str:
-    """Optimize keyword distribution throughout the content."""
-    # Count current keyword occurrences
-    keyword_count = text.lower().count(keyword.lower())
-    
-    # If keyword appears too rarely, this will be handled by the AI model
-    # through our enhanced prompts that emphasize natural keyword distribution
-    
-    return text
-
-def add_engaging_elements(text: str) -> str:
-    """Add engaging elements like questions, statistics, and calls-to-action."""
-    # This function can be expanded to add more engaging elements
-    # For now, we rely on the AI model to generate engaging content
-    return text
+    keyword_lower = keyword.lower()
+    for triggers, substitutions, extras in _VARIATION_RULES:
+        if any(t in keyword_lower for t in triggers):
+            variations.extend(keyword.replace(old, new) for old, new in substitutions)
+            variations.extend(extras)
+    # order-preserving dedupe keeps variations[:n] slices deterministic
+    return tuple(dict.fromkeys(variations))
 
 def validate_keyword_adherence(text: str, keyword: str) -> bool:
     """Validate that the generated content properly adheres to the keyword."""
@@ -1205,10 +2081,30 @@ def validate_keyword_adherence(text: str, keyword: str) -> bool:
     
     return total_mentions >= 3
 
+# One combined pattern for every quality metric below: a single finditer walk
+# over the document replaces a dozen separate full-document findall/search
+# passes. Group order mirrors the old per-metric patterns so alternation
+# picks the same matches.
+_QUALITY_SCAN_RE = re.compile(
+    r"(?P<comma>[^\s]،[^\s])"
+    r"|(?P<verb>می[ا-ی])"
+    r"|(?P<compound>راهها|راهکارهای|وبسایتهایی)"
+    r"|(?P<h1><h1[^>]*>)"
+    r"|(?P<h2><h2[^>]*>)"
+    r"|(?P<p><p[^>]*>)"
+    r"|(?P<tbl><table[^>]*>)"
+    r"|(?P<emo>تصور کنید|بیایید|حتما|مطمئنا|قطعا|بدون شک)"
+    r"|(?P<ex>مثال|برای مثال|به عنوان مثال|مثلا)"
+    r"|(?P<q>\?|چگونه|چرا|چه|کدام)"
+    r"|(?P<c0>مقدمه|آغاز|شروع)"
+    r"|(?P<c1>نتیجه|جمع‌بندی|خلاصه)"
+    r"|(?P<c2>مزایا|فواید|مزیت)"
+    r"|(?P<c3>معایب|نکات|توجه)"
+    r"|(?P<c4>راهکار|راه‌حل|پیشنهاد)")
+
 def advanced_content_quality_check(content: str, keyword: str) -> Dict[str, Any]:
     """Advanced content quality validation with detailed metrics."""
-    import re
-    
+
     quality_metrics = {
         "word_count": count_words(content),
         "keyword_density": 0.0,
@@ -1231,75 +2127,49 @@ def advanced_content_quality_check(content: str, keyword: str) -> Dict[str, Any]
     quality_metrics["keyword_density"] = keyword_density
     quality_metrics["keyword_adequate"] = 0.5 <= keyword_density <= 3.0
     
-    # Persian typography check
-    typo_issues = 0
-    total_checks = 0
-    
-    # Check comma spacing
-    comma_pattern = r'[^\s]،[^\s]'
-    comma_issues = len(re.findall(comma_pattern, content))
-    typo_issues += comma_issues
-    total_checks += 1
-    
-    # Check verb spacing
-    verb_pattern = r'می[ا-ی]'
-    verb_issues = len(re.findall(verb_pattern, content))
-    typo_issues += verb_issues
-    total_checks += 1
-    
-    # Check compound word spacing
-    compound_issues = 0
-    compound_patterns = [r'راهها', r'راهکارهای', r'وبسایتهایی']
-    for pattern in compound_patterns:
-        compound_issues += len(re.findall(pattern, content))
-    typo_issues += compound_issues
-    total_checks += 1
-    
+    # Single streaming pass over the document; every metric below reads from
+    # these counters instead of its own findall
+    counts = {g: 0 for g in ("comma", "verb", "compound", "h1", "h2", "p",
+                             "tbl", "emo", "ex", "q")}
+    completeness_seen = set()
+    for m in _QUALITY_SCAN_RE.finditer(content):
+        group = m.lastgroup
+        if group in counts:
+            counts[group] += 1
+            # راهکارهای matched as a compound typo also satisfies the
+            # راهکار completeness indicator, as it did with separate passes
+            if group == "compound" and m.group().startswith("راهکار"):
+                completeness_seen.add("c4")
+        else:
+            completeness_seen.add(group)
+
+    # Persian typography check (comma spacing, verb spacing, compound words)
+    typo_issues = counts["comma"] + counts["verb"] + counts["compound"]
+    total_checks = 3
     quality_metrics["persian_typo_score"] = max(0, 1 - (typo_issues / (total_checks * 10)))
     quality_metrics["typo_adequate"] = quality_metrics["persian_typo_score"] > 0.8
-    
+
     # Structure check
-    h1_count = len(re.findall(r'<h1[^>]*>', content))
-    h2_count = len(re.findall(r'<h2[^>]*>', content))
-    p_count = len(re.findall(r'<p[^>]*>', content))
-    table_count = len(re.findall(r'<table[^>]*>', content))
-    
     structure_score = 0
-    if h1_count >= 1:
+    if counts["h1"] >= 1:
         structure_score += 0.2
-    if h2_count >= 6:
+    if counts["h2"] >= 6:
         structure_score += 0.3
-    if p_count >= 15:
+    if counts["p"] >= 15:
         structure_score += 0.3
-    if table_count >= 2:
+    if counts["tbl"] >= 2:
         structure_score += 0.2
-    
+
     quality_metrics["structure_score"] = structure_score
     quality_metrics["structure_adequate"] = structure_score >= 0.8
-    
-    # Engagement check (emotional words, examples, etc.)
-    emotional_words = len(re.findall(r'(تصور کنید|بیایید|حتما|مطمئنا|قطعا|بدون شک)', content))
-    example_words = len(re.findall(r'(مثال|برای مثال|به عنوان مثال|مثلا)', content))
-    question_words = len(re.findall(r'(\?|چگونه|چرا|چه|کدام)', content))
-    
-    engagement_score = min(1.0, (emotional_words + example_words + question_words) / 20)
+
+    # Engagement check (emotional words, examples, questions)
+    engagement_score = min(1.0, (counts["emo"] + counts["ex"] + counts["q"]) / 20)
     quality_metrics["engagement_score"] = engagement_score
     quality_metrics["engagement_adequate"] = engagement_score >= 0.3
-    
-    # Completeness check
-    completeness_indicators = [
-        r'مقدمه|آغاز|شروع',
-        r'نتیجه|جمع‌بندی|خلاصه',
-        r'مزایا|فواید|مزیت',
-        r'معایب|نکات|توجه',
-        r'راهکار|راه‌حل|پیشنهاد'
-    ]
-    
-    completeness_score = 0
-    for indicator in completeness_indicators:
-        if re.search(indicator, content, re.IGNORECASE):
-            completeness_score += 0.2
-    
+
+    # Completeness check (intro, conclusion, pros, cons, solutions)
+    completeness_score = 0.2 * len(completeness_seen)
     quality_metrics["completeness_score"] = min(1.0, completeness_score)
     quality_metrics["completeness_adequate"] = completeness_score >= 0.6
     
@@ -1318,44 +2188,50 @@ def advanced_content_quality_check(content: str, keyword: str) -> Dict[str, Any]
     
     return quality_metrics
 
-def enhance_keyword_distribution(text: str, keyword: str) -> str:
-    """Enhance keyword distribution if it's insufficient."""
-    if not validate_keyword_adherence(text, keyword):
-        # This would trigger additional content generation or modification
-        # For now, we'll rely on the AI model to handle this through prompts
-        pass
-    return text
+# Normalization rules, compiled once at import. Every sub() pass scans the
+# whole document, so related rules are merged into single alternation patterns
+# (both comma kinds in one pass, all compound-word fixes in one pass) instead
+# of one scan per rule.
+_YEH_KAF_TRANSLATION = str.maketrans("\u064A\u0643", "\u06CC\u06A9")
+_MI_PREFIX_RE = re.compile(r"\u0646?\u0645\u06CC[\u200C\-]?(?=[\u0600-\u06FF])")
+_COMMA_RE = re.compile(r"\s*([\u060C,])\s*")
+_COMPOUND_SUFFIX_RE = re.compile(
+    r"(\u0631\u0627\u0647\u06A9\u0627\u0631|\u0631\u0627\u0647|\u0648\u0628\u0633\u0627\u06CC\u062A)"
+    r"[\u200C \t]*"
+    r"(\u0647\u0627\u06CC\u06CC|\u0647\u0627\u06CC|\u0647\u0627)")
+_MULTISPACE_RE = re.compile(r"[ \t]{2,}")
+_MULTINEWLINE_RE = re.compile(r"\n{3,}")
+
+def _space_mi(m) -> str:
+    return m.group(0).replace("\u200C", " ").replace("-", " ").replace("\u0645\u06CC", "\u0645\u06CC ")
 
 def normalize_persian_spacing_and_mi(text: str) -> str:
-    text = text.replace("\u064A", "\u06CC").replace("\u0643", "\u06A9")
+    # Arabic yeh/kaf -> Persian in one C-level table pass
+    text = text.translate(_YEH_KAF_TRANSLATION)
     # mi with space
-    text = re.sub(r"ن?می[\u200C\-]?(?=[\u0600-\u06FF])", lambda m: m.group(0).replace("\u200C", " ").replace("-", " ").replace("می", "می "), text)
-    # comma spacing
-    text = re.sub(r"\s*،\s*", " ، ", text)
-    text = re.sub(r"\s*,\s*", " , ", text)
-    
-    # Fix new spacing rules for compound words
-    text = re.sub(r'راهها', r'راه ها', text)
-    text = re.sub(r'راهکارهای', r'راهکار های', text)
-    text = re.sub(r'وبسایتهایی', r'وبسایت هایی', text)
-    text = re.sub(r'راه([\s]*)(ها)', r'راه ها', text)
-    text = re.sub(r'راهکار([\s]*)(های)', r'راهکار های', text)
-    text = re.sub(r'وبسایت([\s]*)(هایی)', r'وبسایت هایی', text)
-    
+    text = _MI_PREFIX_RE.sub(_space_mi, text)
+    # comma spacing (Persian and Latin comma in the same pass)
+    text = _COMMA_RE.sub(r" \1 ", text)
+    # compound-word spacing (راهها -> راه ها etc.)
+    text = _COMPOUND_SUFFIX_RE.sub(r"\1 \2", text)
     # collapse spaces
-    text = re.sub(r"[ \t]{2,}", " ", text)
-    text = re.sub(r"\n{3,}", "\n\n", text)
+    text = _MULTISPACE_RE.sub(" ", text)
+    text = _MULTINEWLINE_RE.sub("\n\n", text)
     return text.strip()
 
+@functools.lru_cache(maxsize=32)
 def count_words(text: str) -> int:
-    # Improved count: strip HTML tags roughly
-    text = re.sub(r"<[^>]+>", "", text)  # Remove tags
-    words = [w for w in re.split(r"\s+", text) if w.strip()]
-    return len(words)
+    # Improved count: strip HTML tags roughly. Memoized because the same
+    # document is re-counted by the validation prompt, the quality check and
+    # the final log lines.
+    text = _TAG_RE.sub("", text)  # Remove tags
+    return len(text.split())
 
 def parse_args():
     p = argparse.ArgumentParser(description="Generate blog using section-aware RAG.")
-    p.add_argument("--keyword", required=True, help="Primary keyword (Persian).")
+    p.add_argument("--keyword", default=None, help="Primary keyword (Persian).")
+    p.add_argument("--keywords-file", default=None,
+                   help="File with one keyword per line (for --batch bulk runs).")
     p.add_argument("--index", default=DEFAULT_INDEX_PATH, help="FAISS index path.")
     p.add_argument("--meta", default=DEFAULT_META_PATH, help="Metadata JSONL path.")
     p.add_argument("--out", default="outputs/generated_blog.html", help="Output HTML path.")
@@ -1364,6 +2240,10 @@ def parse_args():
     p.add_argument("--model", default=DEFAULT_CHAT_MODEL, help="Chat model.")
     p.add_argument("--temperature", type=float, default=DEFAULT_TEMPERATURE)
     p.add_argument("--max-tokens", type=int, default=DEFAULT_MAX_TOKENS)
+    p.add_argument("--mode", choices=("phased", "sections"), default="phased",
+                   help="phased = two-phase pipeline; sections = structured plan with concurrent section generation.")
+    p.add_argument("--batch", action="store_true",
+                   help="Run all keywords through the OpenAI Batch API (50%% cost, hours of latency).")
     return p.parse_args()
 
 def main():
@@ -1378,10 +2258,35 @@ def main():
     out_path = Path(args.out)
     perfect_html_path = Path(args.perfect_html) if args.perfect_html else None
 
+    if args.batch:
+        keywords = [args.keyword] if args.keyword else []
+        if args.keywords_file:
+            with open(args.keywords_file, encoding="utf-8") as f:
+                keywords.extend(ln.strip() for ln in f if ln.strip())
+        if not keywords:
+            LOG.error("--batch needs --keyword and/or --keywords-file.")
+            sys.exit(2)
+        out_dir = out_path.parent if out_path.suffix else out_path
+        try:
+            written = batch_generate_blogs(client=client, index=index, meta=meta, keywords=keywords,
+                                           out_dir=out_dir, perfect_html_path=perfect_html_path,
+                                           model=args.model, temperature=args.temperature,
+                                           max_tokens=args.max_tokens)
+            LOG.info("Batch generation finished. %d blogs written to %s", len(written), out_dir)
+        except Exception as e:
+            LOG.exception("Batch generation failed: %s", e)
+            sys.exit(1)
+        return
+
+    if not args.keyword:
+        LOG.error("--keyword is required (or use --batch with --keywords-file).")
+        sys.exit(2)
+
+    generate_fn = generate_blog_sectioned if args.mode == "sections" else generate_blog
     try:
-        generated_path = generate_blog(client=client, index=index, meta=meta,
-                                       keyword=args.keyword, out_path=out_path, perfect_html_path=perfect_html_path,
-                                       model=args.model, temperature=args.temperature, max_tokens=args.max_tokens)
+        generated_path = generate_fn(client=client, index=index, meta=meta,
+                                     keyword=args.keyword, out_path=out_path, perfect_html_path=perfect_html_path,
+                                     model=args.model, temperature=args.temperature, max_tokens=args.max_tokens)
         LOG.info("Generation finished. Output: %s", generated_path)
     except Exception as e:
         LOG.exception("Generation failed: %s", e)